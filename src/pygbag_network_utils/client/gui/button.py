@@ -1,9 +1,11 @@
 import pygame
 
-from .consts import BLACK, DARK_BLUE, LIGHT_GRAY, WHITE, FONT_SMALL
+from .consts import BLACK, DARK_BLUE, LIGHT_GRAY, WHITE
+from .text_cache import SMALL_TEXT
+from .widget import Widget
 
 
-class Button:
+class Button(Widget):
     def __init__(self, x, y, width, height, text, color, text_color, action):
         self.rect = pygame.Rect(x, y, width, height)
         self.text = text
@@ -11,12 +13,15 @@ class Button:
         self.text_color = text_color
         self.action = action
 
-    def draw(self, surface):
+    def render(self, surface):
         pygame.draw.rect(surface, self.color, self.rect)
-        text_surface = FONT_SMALL.render(self.text, True, self.text_color)
+        text_surface = SMALL_TEXT.render(self.text, self.text_color)
         text_rect = text_surface.get_rect(center=self.rect.center)
         surface.blit(text_surface, text_rect)
 
+    def render_state(self):
+        return tuple(self.rect), self.text, self.color, self.text_color
+
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
             if self.rect.collidepoint(event.pos):
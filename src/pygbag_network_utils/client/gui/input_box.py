@@ -1,14 +1,15 @@
 import pygame
 
-from .consts import BLACK, DARK_BLUE, LIGHT_GRAY, WHITE, FONT_SMALL
+from .consts import BLACK, DARK_BLUE, LIGHT_GRAY, WHITE
+from .text_cache import SMALL_TEXT
+from .widget import Widget
 
 
-class InputBox:
+class InputBox(Widget):
     def __init__(self, x, y, width, height, text="", on_enter_callback=None):
         self.rect = pygame.Rect(x, y, width, height)
         self.color = BLACK
         self.text = text
-        self.txt_surface = FONT_SMALL.render(text, True, self.color)
         self.active = False
         self.on_enter_callback = on_enter_callback
 
@@ -35,19 +36,20 @@ class InputBox:
                     self.text = self.text[:-1]
                 else:
                     self.text += event.unicode
-                # Re-render the text.
-                self.txt_surface = FONT_SMALL.render(
-                    self.text,
-                    True,
-                    self.color,
-                )
-
-    def draw(self, screen):
+
+    @property
+    def txt_surface(self):
+        return SMALL_TEXT.render(self.text, self.color)
+
+    def render(self, screen):
         pygame.draw.rect(screen, LIGHT_GRAY if self.active else WHITE, self.rect)
         # Blit the text.
         screen.blit(self.txt_surface, (self.rect.x + 5, self.rect.y + 5))
         # Blit the rect.
         pygame.draw.rect(screen, self.color, self.rect, 2)
 
+    def render_state(self):
+        return tuple(self.rect), self.text, self.active, self.color
+
     def set_on_enter_callback(self, callback):
         self.on_enter_callback = callback
@@ -0,0 +1,143 @@
+import bisect
+
+
+class ListModel:
+    """
+    Keyed rows behind a ListView, with a sorted and filtered view.
+
+    Rows are changed one at a time with insert(), update() and remove(), or
+    by diffing a full item list with replace(). The view is a list of row
+    keys, never of items, so sorting and filtering do not copy the rows.
+    Each key's place in the view is found by bisecting a parallel list of
+    (sort key, insertion order) tuples, so a change moves one row instead of
+    re-sorting. version grows with every change, and row_versions[key] is
+    the version that last inserted or updated that row, so views can tell
+    which rows to render again. A key removed and inserted again gets a new
+    version too.
+    """
+
+    def __init__(self, items=(), key=None):
+        # Maps an item to its row key; None keys rows by position.
+        self.key = key
+        self.rows = {}
+        self.row_versions = {}
+        self.version = 0
+        self.sort_key = None
+        self.reverse = False
+        self.filter = None
+        self.view = []
+        self._order = {}
+        self._next_order = 0
+        self._view_keys = []
+        self._placed = {}
+        self.replace(items)
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, index):
+        return self.rows[self.key_at(index)]
+
+    def key_at(self, index):
+        """Return the key of the row shown at index of the view."""
+        if self.reverse:
+            return self.view[len(self.view) - 1 - index]
+        return self.view[index]
+
+    def items(self):
+        """Iterate over the items in view order."""
+        for index in range(len(self.view)):
+            yield self[index]
+
+    def _view_key(self, key, item):
+        if self.sort_key is None:
+            return (self._order[key],)
+        return (self.sort_key(item), self._order[key])
+
+    def _show(self, key, item):
+        if self.filter is not None and not self.filter(item):
+            return
+        view_key = self._view_key(key, item)
+        index = bisect.bisect_right(self._view_keys, view_key)
+        self._view_keys.insert(index, view_key)
+        self.view.insert(index, key)
+        self._placed[key] = view_key
+
+    def _hide(self, key):
+        view_key = self._placed.pop(key, None)
+        if view_key is None:
+            return
+        # Insertion orders are unique, so the bisect lands on this key.
+        index = bisect.bisect_left(self._view_keys, view_key)
+        del self._view_keys[index]
+        del self.view[index]
+
+    def insert(self, key, item):
+        if key in self.rows:
+            self.update(key, item)
+            return
+        self.rows[key] = item
+        self.version += 1
+        self.row_versions[key] = self.version
+        self._order[key] = self._next_order
+        self._next_order += 1
+        self._show(key, item)
+
+    def update(self, key, item):
+        if key not in self.rows:
+            self.insert(key, item)
+            return
+        self.rows[key] = item
+        self.version += 1
+        self.row_versions[key] = self.version
+        visible = self.filter is None or self.filter(item)
+        if not visible or self._placed.get(key) != self._view_key(key, item):
+            self._hide(key)
+            self._show(key, item)
+
+    def remove(self, key):
+        if key not in self.rows:
+            return
+        self._hide(key)
+        del self.rows[key]
+        del self.row_versions[key]
+        del self._order[key]
+        self.version += 1
+
+    def replace(self, items):
+        """
+        Make the rows match items, keyed with self.key, inserting, updating
+        and removing only the rows that differ.
+        """
+        seen = set()
+        for index, item in enumerate(items):
+            key = index if self.key is None else self.key(item)
+            seen.add(key)
+            if key not in self.rows:
+                self.insert(key, item)
+            elif self.rows[key] != item:
+                self.update(key, item)
+        for key in [key for key in self.rows if key not in seen]:
+            self.remove(key)
+
+    def set_sort(self, sort_key=None, reverse=False):
+        """Order the view by sort_key(item), or by insertion order for None."""
+        self.sort_key = sort_key
+        self.reverse = reverse
+        self._rebuild()
+
+    def set_filter(self, predicate=None):
+        """Show only the rows for which predicate(item) is true."""
+        self.filter = predicate
+        self._rebuild()
+
+    def _rebuild(self):
+        placed = []
+        for key, item in self.rows.items():
+            if self.filter is None or self.filter(item):
+                placed.append((self._view_key(key, item), key))
+        placed.sort(key=lambda pair: pair[0])
+        self._view_keys = [view_key for view_key, _ in placed]
+        self.view = [key for _, key in placed]
+        self._placed = {key: view_key for view_key, key in placed}
+        self.version += 1
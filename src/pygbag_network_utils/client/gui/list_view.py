@@ -1,12 +1,27 @@
 import pygame
 
-from .consts import BLACK, DARK_BLUE, FONT_SMALL, GRAY
+from .consts import BLACK, DARK_BLUE, GRAY
+from .list_model import ListModel
+from .text_cache import SMALL_TEXT
+from .widget import Widget
 
 
-class ListView:
-    def __init__(self, x, y, width, height, items, item_height=30):
+class ListView(Widget):
+    """
+    Scrollable list that only renders the rows in view.
+
+    items is a ListModel or a plain list; plain lists are wrapped in a model
+    keyed by key(item), or by position without a key. Each row's text is
+    formatted once per row version and rendered through SMALL_TEXT, so
+    scrolling, which is by pixel, only blits cached surfaces.
+    """
+
+    def __init__(
+        self, x, y, width, height, items, item_height=30, key=None, format_item=str
+    ):
         self.rect = pygame.Rect(x, y, width, height)
-        self.items = items
+        self.model = items if isinstance(items, ListModel) else ListModel(items, key)
+        self.format_item = format_item
         self.item_height = item_height
         self.scroll_offset = 0
         self.scroll_speed = 10
@@ -14,35 +29,65 @@ class ListView:
         self.dragging = False
         self.drag_offset_y = 0
         self.scrollbar_rect = None
+        # Maps row key to (row version, formatted text), for recently shown rows.
+        self.row_texts = {}
 
-    def draw(self, surface):
-        pygame.draw.rect(surface, GRAY, self.rect)
-        pygame.draw.rect(surface, BLACK, self.rect, 2)
+    @property
+    def items(self):
+        return list(self.model.items())
+
+    @items.setter
+    def items(self, new_itemlist):
+        self.update_items(new_itemlist)
 
+    def max_offset(self):
+        return max(0, len(self.model) * self.item_height - self.rect.height)
+
+    def visible_range(self):
+        """Indices of the first and past the last row at least partly in view."""
         start_index = self.scroll_offset // self.item_height
-        end_index = start_index + self.rect.height // self.item_height
-        # logger.debug(f"Drawing items {start_index} to {end_index}")
-
-        for i, item in enumerate(self.items[start_index:end_index], start=start_index):
-            item_rect = pygame.Rect(
-                self.rect.x,
-                self.rect.y + (i - start_index) * self.item_height,
-                self.rect.width,
-                self.item_height,
-            )
-            # pygame.draw.rect(surface, WHITE, item_rect)
-            text_surface = FONT_SMALL.render(f"{item}", True, BLACK)
-            surface.blit(text_surface, (item_rect.x + 5, item_rect.y + 5))
+        end_index = (self.scroll_offset + self.rect.height) // self.item_height + 1
+        return start_index, min(end_index, len(self.model))
+
+    def row_surface(self, key):
+        version = self.model.row_versions[key]
+        cached = self.row_texts.get(key)
+        if cached is not None and cached[0] == version:
+            text = cached[1]
+        else:
+            text = self.format_item(self.model.rows[key])
+            self.row_texts[key] = (version, text)
+        return SMALL_TEXT.render(text, BLACK)
+
+    def render(self, surface):
+        # Rows may have been removed since the last scroll.
+        self.scroll_offset = min(self.scroll_offset, self.max_offset())
+        pygame.draw.rect(surface, GRAY, self.rect)
+
+        start_index, end_index = self.visible_range()
+        visible = set()
+        previous_clip = surface.get_clip()
+        surface.set_clip(self.rect)
+        for i in range(start_index, end_index):
+            key = self.model.key_at(i)
+            visible.add(key)
+            y = self.rect.y + i * self.item_height - self.scroll_offset
+            surface.blit(self.row_surface(key), (self.rect.x + 5, y + 5))
+        surface.set_clip(previous_clip)
+        # Keep a few screens of rows around for scrolling back.
+        if len(self.row_texts) > 4 * max(len(visible), 16):
+            for key in [key for key in self.row_texts if key not in visible]:
+                del self.row_texts[key]
+
+        pygame.draw.rect(surface, BLACK, self.rect, 2)
 
         # Draw scrollbar
-        if len(self.items) * self.item_height > self.rect.height:
-            scrollbar_height = self.rect.height * (
-                self.rect.height / (len(self.items) * self.item_height)
-            )
+        self.scrollbar_rect = None
+        content_height = len(self.model) * self.item_height
+        if content_height > self.rect.height:
+            scrollbar_height = self.rect.height * (self.rect.height / content_height)
             scrollbar_y = (
-                self.rect.y
-                + (self.scroll_offset / (len(self.items) * self.item_height))
-                * self.rect.height
+                self.rect.y + (self.scroll_offset / content_height) * self.rect.height
             )
             self.scrollbar_rect = pygame.Rect(
                 self.rect.right - self.scrollbar_width,
@@ -52,6 +97,9 @@ class ListView:
             )
             pygame.draw.rect(surface, DARK_BLUE, self.scrollbar_rect)
 
+    def render_state(self):
+        return tuple(self.rect), self.scroll_offset, self.model.version
+
     def handle_event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
             if (
@@ -64,11 +112,8 @@ class ListView:
             elif event.button == 4 and self.rect.collidepoint(event.pos):  # Scroll up
                 self.scroll_offset = max(self.scroll_offset - self.scroll_speed, 0)
             elif event.button == 5 and self.rect.collidepoint(event.pos):  # Scroll down
-                max_offset = max(
-                    0, len(self.items) * self.item_height - self.rect.height
-                )
                 self.scroll_offset = min(
-                    self.scroll_offset + self.scroll_speed, max_offset
+                    self.scroll_offset + self.scroll_speed, self.max_offset()
                 )
         elif event.type == pygame.MOUSEBUTTONUP:
             if event.button == 1:
@@ -76,13 +121,12 @@ class ListView:
         elif event.type == pygame.MOUSEMOTION:
             if self.dragging:
                 new_y = event.pos[1] - self.drag_offset_y
-                max_offset = max(
-                    0, len(self.items) * self.item_height - self.rect.height
-                )
+                max_offset = self.max_offset()
                 self.scroll_offset = int(
                     ((new_y - self.rect.y) / self.rect.height) * max_offset
                 )
                 self.scroll_offset = max(0, min(self.scroll_offset, max_offset))
 
     def update_items(self, new_itemlist):
-        self.items = new_itemlist
+        """Diff new_itemlist against the rows, re-rendering only changed rows."""
+        self.model.replace(new_itemlist)
@@ -0,0 +1,40 @@
+import collections
+
+from .consts import FONT_SMALL
+
+
+class TextCache:
+    """
+    Rendered text surfaces of one font, keyed by text, color and antialiasing
+    and evicted least recently used first. Text that is drawn every frame is
+    rendered once instead of once per frame.
+    """
+
+    def __init__(self, font, max_size=512):
+        self.font = font
+        self.max_size = max_size
+        self.surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text, color, antialias=True):
+        # pygame.Color is not hashable; tuples and color names are.
+        if not isinstance(color, (tuple, str)):
+            color = tuple(color)
+        key = (text, color, antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = self.surfaces[key] = self.font.render(text, antialias, color)
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+
+SMALL_TEXT = TextCache(FONT_SMALL)
@@ -0,0 +1,40 @@
+class Widget:
+    """
+    Base for widgets that know when they need redrawing.
+
+    Subclasses implement render(surface), which paints the whole of
+    self.rect, and render_state(), which returns a cheap comparable summary
+    of everything render() depends on. draw() always renders.
+    draw_if_dirty() only renders when the state changed since the last draw
+    or mark_dirty() was called. Both return the rects they touched, for
+    pygame.display.update(rects).
+    """
+
+    dirty = True
+    _drawn_state = None
+    _drawn_rect = None
+
+    def render(self, surface):
+        raise NotImplementedError("You must implement render in your subclass!")
+
+    def render_state(self):
+        raise NotImplementedError("You must implement render_state in your subclass!")
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def draw(self, surface):
+        self.render(surface)
+        self._drawn_state = self.render_state()
+        self.dirty = False
+        rects = [self.rect.copy()]
+        if self._drawn_rect is not None and self._drawn_rect != self.rect:
+            # Moved or resized: the old area needs repainting too.
+            rects.append(self._drawn_rect)
+        self._drawn_rect = self.rect.copy()
+        return rects
+
+    def draw_if_dirty(self, surface):
+        if not self.dirty and self.render_state() == self._drawn_state:
+            return []
+        return self.draw(surface)
@@ -0,0 +1,113 @@
+import bisect
+import collections
+import time
+
+
+def interpolate(a, b, t):
+    """
+    Blend two states: numbers are interpolated, dicts and equally long lists
+    are blended item by item, and anything else keeps a's value until t
+    reaches 1. Keys only in b appear at once; keys only in a are dropped.
+    """
+    if isinstance(a, bool) or isinstance(b, bool):
+        return b if t >= 1 else a
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a + (b - a) * t
+    if isinstance(a, dict) and isinstance(b, dict):
+        return {
+            key: interpolate(a[key], value, t) if key in a else value
+            for key, value in b.items()
+        }
+    if isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        return [interpolate(x, y, t) for x, y in zip(a, b)]
+    return b if t >= 1 else a
+
+
+class SnapshotBuffer:
+    """
+    Ring buffer of timestamped server snapshots, sampled at render time.
+
+    Rendering runs `delay` seconds behind the newest snapshot, so there is
+    usually a snapshot on either side of the render time and sample() can
+    blend them. A server ticking at 10-20 Hz then still renders smoothly at
+    60 FPS; the delay should cover about two snapshot intervals plus jitter.
+
+    Snapshots are stamped with the local receive time, or with the server's
+    time if push() is given one. The offset between the two clocks is then
+    estimated from the receive times and smoothed, so network jitter does not
+    jerk the render time around.
+    """
+
+    def __init__(
+        self,
+        delay=0.1,
+        size=32,
+        interpolate=interpolate,
+        clock=time.monotonic,
+        offset_smoothing=0.1,
+    ):
+        self.delay = delay
+        self.interpolate = interpolate
+        self.clock = clock
+        self.offset_smoothing = offset_smoothing
+        self.times = collections.deque(maxlen=size)
+        self.states = collections.deque(maxlen=size)
+        # Local clock minus server clock, once server times are pushed.
+        self.offset = None
+
+    def push(self, state, server_time=None):
+        """
+        Add a snapshot. Snapshots older than the newest one are dropped, so
+        late, reordered messages do not move the state backwards. Returns
+        False for those.
+        """
+        now = self.clock()
+        if server_time is None:
+            stamp = now
+        else:
+            sample = now - server_time
+            if self.offset is None:
+                self.offset = sample
+            else:
+                self.offset += (sample - self.offset) * self.offset_smoothing
+            stamp = server_time
+        if self.times and stamp <= self.times[-1]:
+            return False
+        self.times.append(stamp)
+        self.states.append(state)
+        return True
+
+    def render_time(self, now=None):
+        """The snapshot time to show at local time now."""
+        if now is None:
+            now = self.clock()
+        if self.offset is not None:
+            now -= self.offset
+        return now - self.delay
+
+    def sample(self, now=None):
+        """
+        Return the state to render at local time now, None before the first
+        snapshot. Outside the buffered range the oldest or newest snapshot is
+        returned as is.
+        """
+        if not self.states:
+            return None
+        render_time = self.render_time(now)
+        index = bisect.bisect_right(self.times, render_time)
+        if index == 0:
+            return self.states[0]
+        if index == len(self.times):
+            return self.states[-1]
+        before = self.times[index - 1]
+        after = self.times[index]
+        t = (render_time - before) / (after - before)
+        return self.interpolate(self.states[index - 1], self.states[index], t)
+
+    def clear(self):
+        self.times.clear()
+        self.states.clear()
+        self.offset = None
+
+    def __len__(self):
+        return len(self.states)
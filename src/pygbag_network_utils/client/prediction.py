@@ -0,0 +1,54 @@
+import collections
+
+
+class InputPredictor:
+    """
+    Client-side prediction with server reconciliation.
+
+    apply(state, input) must be the same simulation step the server runs for
+    an input, returning the new state without changing the old one. predict()
+    applies an input locally right away and numbers it, so the player sees
+    the result without waiting a round trip. When an authoritative state
+    arrives with the number of the last input the server applied,
+    reconcile() drops the acknowledged inputs and replays the remaining ones
+    on top of it, correcting any misprediction.
+    """
+
+    def __init__(self, apply, state=None, max_pending=256):
+        self.apply = apply
+        self.state = state
+        self.max_pending = max_pending
+        # (seq, input) pairs not yet acknowledged by the server, oldest first.
+        self.pending = collections.deque()
+        self.seq = 0
+        self.acked = 0
+
+    def predict(self, input):
+        """
+        Apply input to the predicted state and return the message to send,
+        {"input": input, "seq": seq}.
+        """
+        self.seq += 1
+        self.pending.append((self.seq, input))
+        if len(self.pending) > self.max_pending:
+            # The server has stopped acknowledging; do not grow without bound.
+            self.pending.popleft()
+        if self.state is not None:
+            self.state = self.apply(self.state, input)
+        return {"input": input, "seq": self.seq}
+
+    def reconcile(self, state, acked):
+        """
+        Rebase the prediction on an authoritative state that includes every
+        input up to seq acked. Returns the new predicted state.
+        """
+        if acked < self.acked:
+            # An older state than one already reconciled; keep the newer one.
+            return self.state
+        self.acked = acked
+        while self.pending and self.pending[0][0] <= acked:
+            self.pending.popleft()
+        for _, input in self.pending:
+            state = self.apply(state, input)
+        self.state = state
+        return state
@@ -0,0 +1,46 @@
+import collections
+import logging
+
+from ..delta import apply_delta
+
+
+class SnapshotReceiver:
+    """
+    Client side of server.replication.StateReplicator.
+
+    Feed it every snapshot message from the server. It rebuilds the full
+    state from keyframes and deltas and tells the caller which ack to send.
+    """
+
+    def __init__(self, history_size=64):
+        self.history_size = history_size
+        self.states = collections.OrderedDict()
+        self.state = None
+        self.seq = 0
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def handle_message(self, data):
+        """
+        Apply a snapshot message. Returns the ack message to send back, or
+        None if data was not a snapshot or its baseline is unknown.
+        """
+        if not isinstance(data, dict) or "snapshot" not in data:
+            return None
+        seq = data["snapshot"]
+        if seq <= self.seq:
+            return None
+        if "state" in data:
+            state = data["state"]
+        else:
+            baseline = self.states.get(data.get("baseline"))
+            if baseline is None:
+                self.logger.debug(f"Missing baseline for snapshot {seq}")
+                return None
+            state = apply_delta(baseline, data["delta"])
+
+        self.seq = seq
+        self.state = state
+        self.states[seq] = state
+        while len(self.states) > self.history_size:
+            self.states.popitem(last=False)
+        return {"ack": seq}
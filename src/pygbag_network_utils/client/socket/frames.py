@@ -0,0 +1,283 @@
+import base64
+import hashlib
+import os
+import struct
+import zlib
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+CONTROL_OPCODES = (OP_CLOSE, OP_PING, OP_PONG)
+# Every other opcode is reserved (RFC 6455 section 5.2).
+OPCODES = (OP_CONTINUATION, OP_TEXT, OP_BINARY) + CONTROL_OPCODES
+
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Offered in the handshake. The client never compresses what it sends, so it
+# promises not to reuse a compression context and the server needs no
+# decompressor per connection.
+DEFLATE_OFFER = "; ".join(
+    ("permessage-deflate", "client_no_context_takeover", "client_max_window_bits")
+)
+EMPTY_BLOCK = b"\x00\x00\xff\xff"
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def make_key():
+    return base64.b64encode(os.urandom(16)).decode("ascii")
+
+
+def accept_key(key):
+    digest = hashlib.sha1((key + GUID).encode("ascii")).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def build_handshake(host, port, path, key, headers=None):
+    """Return the HTTP upgrade request opening a websocket connection."""
+    lines = [
+        f"GET {path} HTTP/1.1",
+        f"Host: {host}:{port}",
+        "Upgrade: websocket",
+        "Connection: Upgrade",
+        f"Sec-WebSocket-Key: {key}",
+        "Sec-WebSocket-Version: 13",
+    ]
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii")
+
+
+def parse_handshake_response(response, key):
+    """
+    Check the server's answer to build_handshake and return its headers with
+    lower-cased names. Raises ProtocolError if the upgrade was refused.
+    """
+    lines = response.decode("iso-8859-1").split("\r\n")
+    status = lines[0].split(" ", 2)
+    if len(status) < 2 or status[1] != "101":
+        raise ProtocolError(f"Upgrade refused: {lines[0]}")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    if headers.get("sec-websocket-accept") != accept_key(key):
+        raise ProtocolError("Invalid Sec-WebSocket-Accept header")
+    return headers
+
+
+class Inflater:
+    """Decompresses the permessage-deflate messages of one connection."""
+
+    def __init__(self, window_bits=15, no_context_takeover=False):
+        self.window_bits = window_bits
+        self.no_context_takeover = no_context_takeover
+        self.decoder = None
+
+    def decompress(self, payload, max_size):
+        if self.decoder is None or self.no_context_takeover:
+            self.decoder = zlib.decompressobj(wbits=-self.window_bits)
+        try:
+            data = self.decoder.decompress(payload + EMPTY_BLOCK, max_size)
+        except zlib.error as e:
+            raise ProtocolError(f"Decompression failed: {e}")
+        if self.decoder.unconsumed_tail:
+            raise ProtocolError("Message is too big")
+        if self.no_context_takeover:
+            self.decoder = None
+        return data
+
+
+def negotiate_deflate(headers):
+    """
+    Return an Inflater for the permessage-deflate parameters the server
+    accepted in its handshake headers, or None if it declined compression.
+    """
+    value = headers.get("sec-websocket-extensions")
+    if not value:
+        return None
+    for extension in value.split(","):
+        name, *params = [part.strip() for part in extension.split(";")]
+        if name != "permessage-deflate":
+            continue
+        window_bits = 15
+        no_context_takeover = False
+        for param in params:
+            key, _, setting = param.partition("=")
+            if key.strip() == "server_max_window_bits":
+                window_bits = int(setting.strip().strip('"'))
+            elif key.strip() == "server_no_context_takeover":
+                no_context_takeover = True
+        return Inflater(window_bits, no_context_takeover)
+    raise ProtocolError(f"Unexpected extensions: {value}")
+
+
+def mask_payload(payload, mask):
+    """XOR payload with the 4-byte mask in one big-integer operation."""
+    if not payload:
+        return b""
+    length = len(payload)
+    repeated = (mask * (length // 4 + 1))[:length]
+    masked = int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")
+    return masked.to_bytes(length, "big")
+
+
+def encode_frame(opcode, payload, fin=True, rsv1=False, mask=True):
+    """Encode one frame. Clients must mask every frame they send."""
+    first = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", first, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", first, mask_bit | 126, length)
+    else:
+        header = struct.pack("!BBQ", first, mask_bit | 127, length)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + mask_payload(payload, key)
+
+
+def encode_message(opcode, payload, max_frame_size=None, rsv1=False):
+    """
+    Encode a message, split into continuation frames when it is larger than
+    max_frame_size.
+    """
+    if not max_frame_size or len(payload) <= max_frame_size:
+        return encode_frame(opcode, payload, rsv1=rsv1)
+    frames = []
+    for start in range(0, len(payload), max_frame_size):
+        chunk = payload[start : start + max_frame_size]
+        last = start + max_frame_size >= len(payload)
+        frames.append(
+            encode_frame(
+                opcode if start == 0 else OP_CONTINUATION,
+                chunk,
+                fin=last,
+                rsv1=rsv1 and start == 0,
+            )
+        )
+    return b"".join(frames)
+
+
+def encode_close(code=CLOSE_NORMAL, reason=""):
+    return encode_frame(OP_CLOSE, struct.pack("!H", code) + reason.encode("utf-8"))
+
+
+class FrameParser:
+    """
+    Incremental frame parser over one reusable bytearray.
+
+    feed() appends received bytes and returns every complete message as an
+    (opcode, payload, compressed) tuple, with fragmented messages reassembled.
+    Headers are read through a memoryview and the buffer is compacted once per
+    feed, so several messages arriving in one recv do not shift the buffer
+    once per message. Each payload is copied out of the buffer once, since
+    the buffer is reused; masked payloads, which only clients send, are
+    copied again when unmasked.
+    """
+
+    def __init__(self, max_message_size=2**20):
+        self.buffer = bytearray()
+        self.max_message_size = max_message_size
+        self.fragments = []
+        self.fragment_opcode = None
+        self.fragment_compressed = False
+        self.fragment_size = 0
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        offset = 0
+        with memoryview(self.buffer) as view:
+            while True:
+                frame = self._parse_frame(view, offset)
+                if frame is None:
+                    break
+                offset, fin, rsv1, opcode, payload = frame
+                message = self._assemble(fin, rsv1, opcode, payload)
+                if message is not None:
+                    messages.append(message)
+        if offset:
+            del self.buffer[:offset]
+        return messages
+
+    def _parse_frame(self, view, offset):
+        available = len(view) - offset
+        if available < 2:
+            return None
+        first, second = view[offset], view[offset + 1]
+        # RSV1 is permessage-deflate's; nothing negotiates RSV2 or RSV3.
+        if first & 0x30:
+            raise ProtocolError("Reserved bits set")
+        if first & 0x0F not in OPCODES:
+            raise ProtocolError(f"Reserved opcode {first & 0x0F:#x}")
+        length = second & 0x7F
+        position = offset + 2
+        if length == 126:
+            if available < 4:
+                return None
+            length = struct.unpack_from("!H", view, position)[0]
+            position += 2
+        elif length == 127:
+            if available < 10:
+                return None
+            length = struct.unpack_from("!Q", view, position)[0]
+            position += 8
+        if length > self.max_message_size:
+            raise ProtocolError(f"Frame of {length} bytes is too big")
+        mask = None
+        if second & 0x80:
+            if len(view) < position + 4:
+                return None
+            mask = bytes(view[position : position + 4])
+            position += 4
+        end = position + length
+        if len(view) < end:
+            return None
+        payload = bytes(view[position:end])
+        if mask is not None:
+            payload = mask_payload(payload, mask)
+        return end, bool(first & 0x80), bool(first & 0x40), first & 0x0F, payload
+
+    def _assemble(self, fin, rsv1, opcode, payload):
+        if opcode in CONTROL_OPCODES:
+            if not fin:
+                raise ProtocolError("Fragmented control frame")
+            return opcode, payload, False
+        if opcode == OP_CONTINUATION:
+            if self.fragment_opcode is None:
+                raise ProtocolError("Unexpected continuation frame")
+        else:
+            if self.fragment_opcode is not None:
+                raise ProtocolError("Expected a continuation frame")
+            if fin:
+                return opcode, payload, rsv1
+            self.fragment_opcode = opcode
+            self.fragment_compressed = rsv1
+        self.fragments.append(payload)
+        self.fragment_size += len(payload)
+        if self.fragment_size > self.max_message_size:
+            raise ProtocolError("Message is too big")
+        if not fin:
+            return None
+        message = (
+            self.fragment_opcode,
+            b"".join(self.fragments),
+            self.fragment_compressed,
+        )
+        self.fragments = []
+        self.fragment_opcode = None
+        self.fragment_compressed = False
+        self.fragment_size = 0
+        return message
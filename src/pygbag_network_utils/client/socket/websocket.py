@@ -1,120 +1,566 @@
 import asyncio
+import errno
 import logging
-import select
+import random
 import socket
-import struct
+import sys
+
+from ...codec import JSON, DecodeError, detect_codec, get_codec
+from .frames import (
+    CLOSE_NORMAL,
+    CLOSE_PROTOCOL_ERROR,
+    DEFLATE_OFFER,
+    OP_BINARY,
+    OP_CLOSE,
+    OP_PING,
+    OP_PONG,
+    OP_TEXT,
+    FrameParser,
+    ProtocolError,
+    build_handshake,
+    encode_close,
+    encode_frame,
+    encode_message,
+    make_key,
+    negotiate_deflate,
+    parse_handshake_response,
+)
+
+RAW = "raw"  # Newline-terminated messages on a socket the browser tunnels
+RFC6455 = "rfc6455"  # Full websocket handshake and framing
+RECV_SIZE = 65536
 
 
 class WebSocketClient:
     """
-    A simple WebSocket client for pygbag, using sockets directly for demonstration.
-    This isn't a full WebSocket implementation; it's a simplified example for
-    communicating with a basic echo server.
+    A WebSocket client for pygbag, using sockets directly.
 
-    Important: For real WebSocket communication, especially in production,
-    use a proper WebSocket library like 'websockets' or 'aiohttp'.
+    Under pygbag (emscripten) the browser already tunnels sockets through a
+    WebSocket, so the "raw" protocol writes newline-terminated messages
+    straight to the socket. Everywhere else the "rfc6455" protocol performs
+    the HTTP upgrade itself and masks, frames and reassembles messages.
     """
 
-    def __init__(self, host, port, on_message_callback=None, socked_name="ws"):
+    def __init__(
+        self,
+        host,
+        port,
+        on_message_callback=None,
+        socked_name="ws",
+        codec=None,
+        path="/",
+        protocol=None,
+        max_frame_size=None,
+        compression=True,
+        auto_flush=True,
+        auto_reconnect=False,
+        resume_session=False,
+        reconnect_base_delay=0.5,
+        reconnect_max_delay=30.0,
+        max_reconnect_attempts=None,
+    ):
         self.host = host
         self.port = port
+        self.path = path
         self.socket = None
         self.running = False
         self.on_message_callback = on_message_callback
-        self.receive_buffer = b""  # Accumulate received data
+        self.receive_buffer = bytearray()  # Accumulate received data
         self.socket_name = socked_name
-        self.buffer = ""
         self.logger = logging.getLogger(f"WebSocketClient-{socked_name}")
+        # With a codec ("json" or "msgpack") incoming messages are decoded
+        # before they reach on_message_callback; without one the callback
+        # receives raw strings.
+        self.codec = get_codec(codec) if codec else None
+        self.stream_decoder = self.codec.stream_decoder() if self.codec else None
+        if protocol is None:
+            protocol = RAW if sys.platform == "emscripten" else RFC6455
+        if protocol not in (RAW, RFC6455):
+            raise ValueError(f"Unknown protocol: {protocol}")
+        self.protocol = protocol
+        # Outgoing messages larger than this are split into continuation frames.
+        self.max_frame_size = max_frame_size
+        # Offer permessage-deflate so the server may compress what it sends.
+        # Under pygbag the browser negotiates compression itself.
+        self.compression = compression
+        self.inflater = None
+        self.parser = None
+        self.close_received = False
+        self.close_event = None
+        self.closing = False
+        self.receive_task = None
+        # Outgoing bytes wait here until the writer task flushes them. With
+        # auto_flush everything queued during one loop turn goes out in one
+        # write; without it nothing is written until flush() is called, e.g.
+        # once per pygame frame.
+        self.auto_flush = auto_flush
+        self.send_buffer = bytearray()
+        self.send_event = None
+        self.drained_event = None
+        self.writer_task = None
+        # Handles a failed send when no receive loop is running.
+        self.connection_lost_task = None
+        # After a lost connection, reconnect with jittered exponential backoff
+        # and, with resume_session, pick up the server session where it left
+        # off so the server only replays what was missed.
+        self.auto_reconnect = auto_reconnect
+        self.resume_session = resume_session
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.reconnecting = False
+        self.stopped = False
+        self.session_token = None
+        self.received_count = 0
+        self.awaiting_session = False
+        # Messages that arrive before the session reply. After a resume they
+        # are replayed by the server anyway, so they are only delivered if the
+        # session turns out to be new.
+        self.pre_session_messages = []
+        # A server without sessions never replies; stop holding messages back
+        # after session_reply_timeout seconds or max_pre_session_messages.
+        self.session_reply_timeout = 5.0
+        self.max_pre_session_messages = 256
+        self.session_timer = None
 
     async def connect(self):
         """Connect to the server."""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setblocking(False)  # Non-blocking socket
-        try:
-            self.socket.connect((self.host, self.port))
-        except BlockingIOError:
-            pass
+        self.logger.debug(f"Connecting to {self.host}:{self.port}...")
+        self.receive_buffer.clear()
+        if self.codec:
+            self.stream_decoder = self.codec.stream_decoder()
+        self.stopped = False
+        self.close_received = False
+        self.close_event = asyncio.Event()
+        if self.resume_session:
+            # Frames can arrive with the handshake response; hold them back
+            # until the session reply tells whether to count them.
+            self.awaiting_session = True
+            self.pre_session_messages = []
+            self.cancel_session_timer()
+            self.session_timer = asyncio.get_running_loop().call_later(
+                self.session_reply_timeout, self.abandon_session
+            )
+        if self.protocol == RFC6455:
+            loop = asyncio.get_running_loop()
+            await loop.sock_connect(self.socket, (self.host, self.port))
+            await self.handshake(loop)
+        else:
+            try:
+                self.socket.connect((self.host, self.port))
+            except BlockingIOError:
+                pass
 
         self.running = True
-        self.logger.debug(f"Connecting to {self.host}:{self.port}...")
+        self.send_event = asyncio.Event()
+        self.drained_event = asyncio.Event()
+        self.drained_event.set()
+        self.writer_task = asyncio.get_running_loop().create_task(self.writer())
+        if self.resume_session:
+            # The session handshake must be the first message on the connection.
+            hello = {"session": self.session_token, "received": self.received_count}
+            self.send_buffer[:0] = self.encode_data(hello)
+            self.flush()
+        elif self.send_buffer and self.auto_flush:
+            self.flush()
+
+    async def handshake(self, loop):
+        """Perform the RFC 6455 opening handshake on the connected socket."""
+        key = make_key()
+        headers = (
+            {"Sec-WebSocket-Extensions": DEFLATE_OFFER} if self.compression else None
+        )
+        request = build_handshake(self.host, self.port, self.path, key, headers)
+        await loop.sock_sendall(self.socket, request)
+        response = bytearray()
+        while b"\r\n\r\n" not in response:
+            chunk = await loop.sock_recv(self.socket, 4096)
+            if not chunk:
+                raise ProtocolError("Connection closed during handshake")
+            response += chunk
+        head, _, rest = bytes(response).partition(b"\r\n\r\n")
+        headers = parse_handshake_response(head, key)
+        self.inflater = negotiate_deflate(headers) if self.compression else None
+        self.parser = FrameParser()
+        self.logger.debug(
+            f"Upgraded connection to ws://{self.host}:{self.port}{self.path}"
+        )
+        if rest:
+            self.handle_data(rest)
 
     async def receive(self):
+        """
+        Receive and deliver messages until the connection closes. The loop
+        wakes only when data arrives and delivers every message it contains
+        before waiting again.
+        """
         self.logger.debug("Starting receive loop...")
-        """Asynchronously receive data from the socket."""
         if self.socket is None:
             self.logger.error("Socket is not initialized.")
             return
 
-        while self.running:
-            # self.logger .debug("Receiving data...")
-            try:
-                ready_to_read, _, _ = select.select([self.socket], [], [], 0.1)
-                if ready_to_read:
-                    data = self.socket.recv(4096)  # Receive up to 4096 bytes
-                    self.logger.debug(f"Received data: {data}")
+        self.receive_task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        try:
+            while self.running:
+                code = CLOSE_NORMAL
+                try:
+                    data = await self.recv_chunk(loop)
                     if data:
-                        decoded_message = data.decode("utf-8")
-                        self.buffer += decoded_message
-                        if decoded_message[-1] == "\n":
-                            decoded_message = self.buffer
-                            self.buffer = ""
-                            decoded_message = decoded_message[:-1]
-                        else:
-                            continue
-
-                        self.logger.debug(
-                            f"Received message has ended with: {decoded_message[-1]}"
-                        )
-                        if self.on_message_callback:
-                            self.on_message_callback(decoded_message, self.socket_name)
-                        else:
-                            self.logger.debug(f"Received message: {decoded_message}")
-                    else:
-                        # Socket closed
-                        self.logger.debug("Server closed the connection.")
-                        await self.close()
-                        return
-                await asyncio.sleep(0.01)  # Yield to the event loop
-
-            except ConnectionResetError:
-                self.logger.error("Connection reset by server.")
-                await self.close()
-                return
-            except Exception as e:
-                self.logger.error(f"Error receiving data: {e}")
-                await self.close()
+                        self.handle_data(data)
+                    if data and not self.close_received:
+                        continue
+                    self.logger.debug("Server closed the connection.")
+                except asyncio.CancelledError:
+                    if self.running:
+                        raise
+                    return
+                except DecodeError as e:
+                    self.logger.error(f"Error decoding data: {e}")
+                except ProtocolError as e:
+                    self.logger.error(f"Protocol error: {e}")
+                    code = CLOSE_PROTOCOL_ERROR
+                except ConnectionResetError:
+                    self.logger.error("Connection reset by server.")
+                except Exception as e:
+                    self.logger.error(f"Error receiving data: {e}")
+                if not await self.connection_lost(code):
+                    return
+        finally:
+            self.receive_task = None
+
+    async def connection_lost(self, code=CLOSE_NORMAL):
+        """Close the broken connection and reconnect if auto_reconnect is on."""
+        await self.disconnect(code, drain=False)
+        if not self.auto_reconnect or self.stopped:
+            return False
+        return await self.reconnect()
+
+    async def recv_chunk(self, loop):
+        """
+        Wait for the next chunk of data; b"" means the server closed the socket.
+
+        Natively this parks on loop.sock_recv. pygbag's browser loop has no
+        socket readiness notifications, so there the socket is drained once
+        per loop turn, which the browser runs once per animation frame.
+        """
+        if sys.platform != "emscripten":
+            return await loop.sock_recv(self.socket, RECV_SIZE)
+        while True:
+            chunks = []
+            closed = False
+            while True:
+                try:
+                    chunk = self.socket.recv(RECV_SIZE)
+                except BlockingIOError:
+                    break
+                if not chunk:
+                    closed = True
+                    break
+                chunks.append(chunk)
+            if chunks:
+                return b"".join(chunks)
+            if closed:
+                return b""
+            await asyncio.sleep(0)
+
+    def handle_data(self, data):
+        """Split received bytes into messages and deliver them."""
+        if self.protocol == RFC6455:
+            for opcode, payload, compressed in self.parser.feed(data):
+                if compressed:
+                    if self.inflater is None:
+                        raise ProtocolError("Compressed message without deflate")
+                    payload = self.inflater.decompress(
+                        payload, self.parser.max_message_size
+                    )
+                self.handle_frame(opcode, payload)
+        elif self.stream_decoder:
+            self.deliver(self.stream_decoder.feed(data))
+        else:
+            self.receive_buffer += data
+            end = self.receive_buffer.rfind(b"\n")
+            if end < 0:
                 return
+            lines = self.receive_buffer[:end].split(b"\n")
+            del self.receive_buffer[: end + 1]
+            self.deliver([line.decode("utf-8") for line in lines if line])
+
+    def handle_frame(self, opcode, payload):
+        if opcode == OP_PING:
+            self.write(encode_frame(OP_PONG, payload))
+        elif opcode == OP_CLOSE:
+            self.close_received = True
+            self.close_event.set()
+        elif opcode == OP_PONG:
+            pass
+        elif self.codec:
+            # Servers answer in the codec of the last message they received,
+            # and only binary codecs use binary frames.
+            codec = JSON if opcode == OP_TEXT else self.codec
+            try:
+                self.deliver([codec.decode(payload)])
+            except DecodeError as e:
+                self.logger.error(f"Error decoding data: {e}")
+        elif opcode == OP_TEXT:
+            message = payload.decode("utf-8")
+            if message.endswith("\n"):
+                message = message[:-1]
+            self.deliver([message])
+        else:
+            self.deliver([payload])
 
-    async def close(self):
-        if self.socket:
+    def deliver(self, messages):
+        for message in messages:
+            if self.awaiting_session:
+                if not self.handle_session_reply(message):
+                    self.pre_session_messages.append(message)
+                    if len(self.pre_session_messages) >= self.max_pre_session_messages:
+                        self.abandon_session()
+                continue
+            if self.session_token is not None:
+                self.received_count += 1
+            self.dispatch(message)
+
+    def dispatch(self, message):
+        if self.on_message_callback:
+            self.on_message_callback(message, self.socket_name)
+        else:
+            self.logger.debug("Received message: %s", message)
+
+    def handle_session_reply(self, message):
+        if isinstance(message, (str, bytes)):
+            marker = "session" if isinstance(message, str) else b"session"
+            if marker not in message:
+                return False
+            try:
+                message = detect_codec(message).decode(message)
+            except DecodeError:
+                return False
+        if not isinstance(message, dict) or "session" not in message:
+            return False
+        self.session_token = message["session"]
+        self.awaiting_session = False
+        self.cancel_session_timer()
+        pending = self.pre_session_messages
+        self.pre_session_messages = []
+        if message.get("resumed"):
+            self.logger.debug("Session resumed")
+        else:
+            self.logger.debug("Session started")
+            self.received_count = 0
+            # Sent before the session began, so not part of its count.
+            for pending_message in pending:
+                self.dispatch(pending_message)
+        return True
+
+    def abandon_session(self):
+        """Carry on without a session when the server does not answer the hello."""
+        self.cancel_session_timer()
+        if not self.awaiting_session:
+            return
+        self.logger.warning("No session reply from the server; continuing without")
+        self.awaiting_session = False
+        self.session_token = None
+        self.received_count = 0
+        pending = self.pre_session_messages
+        self.pre_session_messages = []
+        for message in pending:
+            self.dispatch(message)
+
+    def cancel_session_timer(self):
+        if self.session_timer is not None:
+            self.session_timer.cancel()
+            self.session_timer = None
+
+    async def close(self, code=CLOSE_NORMAL):
+        """Close the connection for good; no reconnect will follow."""
+        self.stopped = True
+        task = self.connection_lost_task
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        await self.disconnect(code)
+
+    async def disconnect(self, code=CLOSE_NORMAL, drain=True):
+        if self.socket and not self.closing:
             self.running = False
+            self.closing = True
             try:
-                # Send a close frame (simplified)
-                self.socket.send(struct.pack("!BB", 0x88, 0x00))
-                # Wait for close frame from server (simplified)
-                self.socket.settimeout(2.0)
-                self.socket.recv(1024)
+                # Let queued messages go out before the close frame
+                if drain:
+                    await asyncio.wait_for(self.drain(), 2.0)
+            except Exception:
+                self.logger.warning(
+                    f"Closing with {len(self.send_buffer)} unsent bytes queued."
+                )
+            try:
+                if self.protocol == RFC6455:
+                    self.socket.send(encode_close(code))
+                    if not self.close_received:
+                        # Give the server a moment to answer with its close frame
+                        await asyncio.wait_for(self.wait_for_close_frame(), 2.0)
             except Exception:
                 pass  # Ignore errors during close
             finally:
+                for task in (self.receive_task, self.writer_task):
+                    if task is not None and task is not asyncio.current_task():
+                        task.cancel()
+                self.writer_task = None
+                self.cancel_session_timer()
                 self.socket.close()
                 self.socket = None
+                self.closing = False
                 self.logger.debug("Connection closed.")
 
+    async def wait_for_close_frame(self):
+        if (
+            self.receive_task is not None
+            and self.receive_task is not asyncio.current_task()
+        ):
+            # The receive loop owns the socket; it reports the close frame.
+            await self.close_event.wait()
+            return
+        loop = asyncio.get_running_loop()
+        while not self.close_received:
+            data = await self.recv_chunk(loop)
+            if not data:
+                return
+            self.handle_data(data)
+
     async def reconnect(self):
-        await self.close()
-        await asyncio.sleep(5)  # Wait before attempting to reconnect
-        await self.connect()
+        """
+        Reconnect with exponential backoff and full jitter. Messages sent in
+        the meantime are kept and go out once the connection is back. Returns
+        False if max_reconnect_attempts ran out or close() was called.
+        """
+        if self.reconnecting:
+            return False
+        self.reconnecting = True
+        try:
+            await self.disconnect(drain=False)
+            attempt = 0
+            while not self.stopped and (
+                self.max_reconnect_attempts is None
+                or attempt < self.max_reconnect_attempts
+            ):
+                delay = min(
+                    self.reconnect_max_delay, self.reconnect_base_delay * 2**attempt
+                )
+                await asyncio.sleep(random.uniform(0, delay))
+                attempt += 1
+                try:
+                    await self.connect()
+                    self.logger.info(f"Reconnected after {attempt} attempt(s).")
+                    return True
+                except (OSError, ProtocolError) as e:
+                    self.logger.warning(f"Reconnect attempt {attempt} failed: {e}")
+                    if self.socket:
+                        self.socket.close()
+                        self.socket = None
+            self.logger.error("Giving up reconnecting.")
+            return False
+        finally:
+            self.reconnecting = False
 
     def send(self, message):
-        if self.socket:
-            try:
-                self.socket.send((message + "\n").encode("utf-8"))
-            except Exception as e:
-                self.logger.error(f"Error sending data: {e}")
-                asyncio.create_task(self.reconnect())
-        else:
+        self.write(self.frame_message(OP_TEXT, (message + "\n").encode("utf-8")))
+
+    def send_data(self, data):
+        """Encode data with the client's codec (JSON by default) and send it."""
+        self.write(self.encode_data(data))
+
+    def encode_data(self, data):
+        codec = self.codec or JSON
+        frame = codec.frame(data)
+        if codec.binary:
+            return self.frame_message(OP_BINARY, frame)
+        return self.frame_message(OP_TEXT, frame.encode("utf-8"))
+
+    def frame_message(self, opcode, payload):
+        if self.protocol == RAW:
+            return payload
+        return encode_message(opcode, payload, self.max_frame_size)
+
+    def write(self, data):
+        """Queue bytes for the writer task; see auto_flush and flush()."""
+        if self.socket is None and not self.reconnecting:
             self.logger.error("Socket is not initialized.")
+            return
+        self.send_buffer += data
+        if self.auto_flush:
+            self.flush()
+
+    def flush(self):
+        """Have the writer send everything queued so far in one write."""
+        if self.send_event is not None and self.send_buffer:
+            self.drained_event.clear()
+            self.send_event.set()
+
+    async def drain(self):
+        """Flush and wait until all queued bytes have been handed to the socket."""
+        self.flush()
+        if self.drained_event is not None:
+            await self.drained_event.wait()
+
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.send_event.wait()
+            self.send_event.clear()
+            while self.send_buffer:
+                data = bytes(self.send_buffer)
+                self.send_buffer.clear()
+                try:
+                    await self.send_all(loop, data)
+                except Exception as e:
+                    self.logger.error(
+                        f"Error sending data, {len(data)} bytes lost: {e}"
+                    )
+                    self.drained_event.set()
+                    if self.receive_task is not None:
+                        # Wake the receive loop; it handles the lost connection.
+                        self.shutdown_socket()
+                    elif self.connection_lost_task is None:
+                        self.connection_lost_task = loop.create_task(
+                            self.connection_lost()
+                        )
+                        self.connection_lost_task.add_done_callback(
+                            self.connection_lost_done
+                        )
+                    return
+            self.drained_event.set()
+
+    def connection_lost_done(self, task):
+        self.connection_lost_task = None
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"Error handling lost connection: {task.exception()}")
+
+    def shutdown_socket(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    async def send_all(self, loop, data):
+        """Write data completely, waiting whenever the socket buffer is full."""
+        if sys.platform != "emscripten":
+            await loop.sock_sendall(self.socket, data)
+            return
+        view = memoryview(data)
+        while view:
+            try:
+                sent = self.socket.send(view)
+            except (BlockingIOError, InterruptedError):
+                await asyncio.sleep(0)
+                continue
+            except OSError as e:
+                if e.errno != errno.ENOTCONN:  # Still connecting
+                    raise
+                await asyncio.sleep(0)
+                continue
+            view = view[sent:]
 
     def set_message_callback(self, callback):
         """Set the callback function for incoming messages."""
@@ -124,5 +570,6 @@ class WebSocketClient:
 async def socket_handler(ws_client):
     """Handle socket connection and messages."""
     await ws_client.connect()
-    await asyncio.sleep(0.1)  # Wait for connection to establish
+    if ws_client.protocol == RAW:
+        await asyncio.sleep(0.1)  # Wait for connection to establish
     await ws_client.receive()
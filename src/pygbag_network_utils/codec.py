@@ -0,0 +1,117 @@
+import json
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+# First bytes of a JSON object or array, optionally after whitespace. These are
+# never the first byte of a msgpack map or array.
+JSON_START_BYTES = frozenset(b"{[ \t\r\n")
+
+
+class DecodeError(ValueError):
+    def __init__(self, codec, detail):
+        super().__init__(f"Invalid {codec} message: {detail}")
+        self.codec = codec
+
+
+class JsonCodec:
+    """Newline-terminated JSON text frames."""
+
+    name = "json"
+    binary = False
+
+    def encode(self, data):
+        return json.dumps(data, separators=(",", ":"))
+
+    def frame(self, data):
+        return self.encode(data) + "\n"
+
+    def decode(self, message):
+        try:
+            return json.loads(message)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise DecodeError(self.name, e) from None
+
+    def stream_decoder(self):
+        return JsonStreamDecoder(self)
+
+
+class JsonStreamDecoder:
+    """Splits a byte stream into newline-terminated JSON messages."""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        end = self.buffer.rfind(b"\n")
+        if end < 0:
+            return []
+        lines = self.buffer[:end].split(b"\n")
+        del self.buffer[: end + 1]
+        return [self.codec.decode(line) for line in lines if line.strip()]
+
+
+class MsgpackCodec:
+    """Binary msgpack frames. Requires the msgpack package."""
+
+    name = "msgpack"
+    binary = True
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def frame(self, data):
+        return self.encode(data)
+
+    def decode(self, message):
+        try:
+            return msgpack.unpackb(message, raw=False)
+        except (ValueError, TypeError) as e:
+            raise DecodeError(self.name, e) from None
+
+    def stream_decoder(self):
+        return MsgpackStreamDecoder(self)
+
+
+class MsgpackStreamDecoder:
+    """Splits a byte stream into msgpack messages."""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.unpacker = msgpack.Unpacker(raw=False)
+
+    def feed(self, data):
+        self.unpacker.feed(data)
+        try:
+            return list(self.unpacker)
+        except (ValueError, TypeError) as e:
+            raise DecodeError(self.codec.name, e) from None
+
+
+JSON = JsonCodec()
+CODECS = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def get_codec(name):
+    """Return the codec registered under name, e.g. "json" or "msgpack"."""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Codec not available: {name}") from None
+
+
+def detect_codec(message):
+    """
+    Guess the codec of an incoming message from its frame type and first byte.
+    Servers answer each connection in the codec it last used, so clients pick
+    their encoding simply by using it.
+    """
+    if isinstance(message, str) or not message or message[0] in JSON_START_BYTES:
+        return JSON
+    return CODECS.get(MsgpackCodec.name, JSON)
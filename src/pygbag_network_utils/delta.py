@@ -0,0 +1,46 @@
+# A delta is a dict with up to three keys:
+#   "s": {key: value} for keys that were added or replaced,
+#   "d": [key, ...] for keys that were removed,
+#   "n": {key: delta} for nested dicts that changed.
+# Values other than dicts (lists included) are always replaced whole.
+SET = "s"
+DELETE = "d"
+NESTED = "n"
+
+
+def diff(old, new):
+    """Return the delta that turns dict old into dict new ({} if equal)."""
+    delta = {}
+    changed = {}
+    nested = {}
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+            continue
+        old_value = old[key]
+        if old_value == value:
+            continue
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            nested[key] = diff(old_value, value)
+        else:
+            changed[key] = value
+    removed = [key for key in old if key not in new]
+    if changed:
+        delta[SET] = changed
+    if removed:
+        delta[DELETE] = removed
+    if nested:
+        delta[NESTED] = nested
+    return delta
+
+
+def apply_delta(base, delta):
+    """Return a new dict with delta applied to base. base is not modified."""
+    result = dict(base)
+    for key, value in delta.get(SET, {}).items():
+        result[key] = value
+    for key in delta.get(DELETE, ()):
+        result.pop(key, None)
+    for key, nested in delta.get(NESTED, {}).items():
+        result[key] = apply_delta(result.get(key) or {}, nested)
+    return result
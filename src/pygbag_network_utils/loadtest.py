@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+import websockets
+
+from .server.hosting import HOSTS
+
+SCENARIOS = ("list", "create", "join", "message")
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(
+        0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def read_rss(pid):
+    """Resident memory of a process in bytes, or None where /proc is missing."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def package_version():
+    try:
+        from importlib.metadata import version
+
+        return version("pygbag_network_utils")
+    except Exception:
+        return "unknown"
+
+
+def raise_file_limit():
+    """Allow as many sockets as the hard limit permits; children inherit it."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class ScenarioResult:
+    def __init__(self, name, clients):
+        self.name = name
+        self.clients = clients
+        self.latencies = []
+        self.errors = 0
+        self.duration = 0.0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        mean = sum(latencies) / len(latencies) if latencies else None
+        return {
+            "clients": self.clients,
+            "requests": len(latencies),
+            "errors": self.errors,
+            "duration": round(self.duration, 3),
+            "throughput": (
+                round(len(latencies) / self.duration, 1) if self.duration else 0.0
+            ),
+            "latency_ms": {
+                "mean": to_ms(mean),
+                "p50": to_ms(percentile(latencies, 0.5)),
+                "p90": to_ms(percentile(latencies, 0.9)),
+                "p99": to_ms(percentile(latencies, 0.99)),
+                "max": to_ms(latencies[-1] if latencies else None),
+            },
+        }
+
+
+class LoadTest:
+    """
+    Drives simulated clients against a MainServer and its EchoServer rooms.
+
+    Without a url the lobby is started as a subprocess on localhost, so its
+    memory can be measured per connection and the harness does not share a
+    core with it. Each scenario runs every client through `requests` request
+    and reply round trips and records their latencies:
+
+    - list: {"command": "list"} on the lobby.
+    - create: {"command": "create"} on the lobby (create_requests per client).
+    - join: {"command": "join"} for one of the rooms, on the lobby.
+    - message: echo messages on connections spread across `rooms` rooms.
+    """
+
+    def __init__(
+        self,
+        url=None,
+        clients=100,
+        requests=10,
+        rooms=1,
+        scenarios=SCENARIOS,
+        create_requests=1,
+        hosting="shared",
+        port=8765,
+        connect_concurrency=100,
+        timeout=10.0,
+    ):
+        self.url = url
+        self.clients = clients
+        self.requests = requests
+        self.rooms = rooms
+        self.scenarios = scenarios
+        self.create_requests = create_requests
+        self.hosting = hosting
+        self.port = port
+        self.connect_concurrency = connect_concurrency
+        self.timeout = timeout
+        self.process = None
+        self.room_addresses = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def start_server(self):
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [package_root, env.get("PYTHONPATH")])
+        )
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "pygbag_network_utils.server.master_server",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(self.port),
+            "--hosting",
+            self.hosting,
+            "--room-idle-timeout",
+            "3600",
+            env=env,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self.url = f"ws://127.0.0.1:{self.port}"
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                async with websockets.connect(self.url):
+                    return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Lobby did not start in time")
+                await asyncio.sleep(0.1)
+
+    async def stop_server(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+
+    def server_rss(self):
+        return read_rss(self.process.pid) if self.process is not None else None
+
+    async def connect_all(self, urls):
+        """Open one connection per url, connect_concurrency at a time."""
+        semaphore = asyncio.Semaphore(self.connect_concurrency)
+
+        async def connect(url):
+            async with semaphore:
+                return await websockets.connect(url, ping_interval=None)
+
+        return await asyncio.gather(*(connect(url) for url in urls))
+
+    async def close_all(self, connections):
+        await asyncio.gather(
+            *(connection.close() for connection in connections),
+            return_exceptions=True,
+        )
+
+    async def round_trip(self, connection, request, is_reply):
+        await connection.send(json.dumps(request))
+        while True:
+            reply = json.loads(await connection.recv())
+            if "error" in reply or is_reply(reply):
+                return reply
+
+    async def run_scenario(self, name, connections, requests, make_request):
+        """
+        Run `requests` round trips on every connection concurrently.
+        make_request(index, n) returns the request and a reply predicate.
+        """
+        result = ScenarioResult(name, len(connections))
+
+        async def client(index, connection):
+            for n in range(requests):
+                request, is_reply = make_request(index, n)
+                start = time.perf_counter()
+                try:
+                    reply = await asyncio.wait_for(
+                        self.round_trip(connection, request, is_reply), self.timeout
+                    )
+                except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+                    result.errors += 1
+                    continue
+                if "error" in reply:
+                    # Rate limits and room limits show up here.
+                    result.errors += 1
+                    continue
+                result.latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(client(index, connection) for index, connection in enumerate(connections))
+        )
+        result.duration = time.perf_counter() - start
+        self.logger.info(f"{name}: {len(result.latencies)} round trips")
+        return result
+
+    async def ensure_rooms(self, lobby):
+        """
+        Create rooms until there are self.rooms. create is rate limited per
+        connection, so the creates rotate over the lobby connections and
+        back off while they are refused.
+        """
+        attempt = 0
+        failures = 0
+        while len(self.room_addresses) < self.rooms:
+            connection = lobby[attempt % len(lobby)]
+            attempt += 1
+            await connection.send(json.dumps({"command": "create"}))
+            reply = json.loads(await connection.recv())
+            if "error" not in reply:
+                self.room_addresses[reply["server_id"]] = reply["address"]
+                failures = 0
+                continue
+            failures += 1
+            if failures > 10:
+                raise RuntimeError(f"Could not create rooms: {reply['error']}")
+            self.logger.debug(f"Room creation refused: {reply['error']}")
+            await asyncio.sleep(min(0.1 * 2**failures, 2.0))
+
+    async def run(self):
+        raise_file_limit()
+        if self.url is None:
+            await self.start_server()
+        try:
+            return await self.run_scenarios()
+        finally:
+            await self.stop_server()
+
+    async def run_scenarios(self):
+        results = {}
+        memory = {}
+        rss_idle = self.server_rss()
+        lobby = await self.connect_all([self.url] * self.clients)
+        rss_lobby = self.server_rss()
+        if rss_idle is not None and rss_lobby is not None:
+            memory["lobby_bytes_per_connection"] = (rss_lobby - rss_idle) // max(
+                len(lobby), 1
+            )
+        try:
+            await self.ensure_rooms(lobby)
+            room_ids = list(self.room_addresses)
+
+            if "list" in self.scenarios:
+                results["list"] = await self.run_scenario(
+                    "list",
+                    lobby,
+                    self.requests,
+                    lambda i, n: ({"command": "list"}, lambda r: "servers" in r),
+                )
+            if "create" in self.scenarios:
+                results["create"] = await self.run_scenario(
+                    "create",
+                    lobby,
+                    self.create_requests,
+                    lambda i, n: (
+                        {"command": "create"},
+                        lambda r: "address" in r,
+                    ),
+                )
+            if "join" in self.scenarios:
+                results["join"] = await self.run_scenario(
+                    "join",
+                    lobby,
+                    self.requests,
+                    lambda i, n: (
+                        {
+                            "command": "join",
+                            "server_id": room_ids[(i + n) % len(room_ids)],
+                        },
+                        lambda r: "address" in r,
+                    ),
+                )
+            if "message" in self.scenarios:
+                rss_before = self.server_rss()
+                urls = [
+                    self.room_addresses[room_ids[i % len(room_ids)]]
+                    for i in range(self.clients)
+                ]
+                players = await self.connect_all(urls)
+                await asyncio.sleep(0.5)
+                rss_after = self.server_rss()
+                if rss_before is not None and rss_after is not None:
+                    memory["room_bytes_per_connection"] = (
+                        rss_after - rss_before
+                    ) // max(len(players), 1)
+                try:
+
+                    def echo(i, n):
+                        token = f"{i}:{n}"
+                        return {"message": token}, lambda r: r.get("echo") == token
+
+                    results["message"] = await self.run_scenario(
+                        "message", players, self.requests, echo
+                    )
+                finally:
+                    await self.close_all(players)
+        finally:
+            await self.close_all(lobby)
+
+        return {
+            "version": package_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {
+                "clients": self.clients,
+                "requests": self.requests,
+                "rooms": self.rooms,
+                "hosting": self.hosting if self.process is not None else None,
+            },
+            "scenarios": {name: result.summary() for name, result in results.items()},
+            "memory": memory,
+        }
+
+
+def compare(results, baseline):
+    """Describe throughput and p99 changes against an earlier results file."""
+    lines = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        parts = []
+        if previous["throughput"]:
+            change = current["throughput"] / previous["throughput"] - 1
+            parts.append(f"throughput {change:+.1%}")
+        old_p99 = previous["latency_ms"]["p99"]
+        new_p99 = current["latency_ms"]["p99"]
+        if old_p99 and new_p99 is not None:
+            parts.append(f"p99 {new_p99 / old_p99 - 1:+.1%}")
+        lines.append(f"{name}: {', '.join(parts)}")
+    return lines
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Load test a MainServer lobby and its EchoServer rooms"
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        default=None,
+        help="Lobby to test (starts a local lobby subprocess if omitted)",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Port for the local lobby"
+    )
+    parser.add_argument(
+        "--hosting",
+        choices=sorted(HOSTS),
+        default="shared",
+        help="Hosting mode of the local lobby",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=100, help="Number of simulated clients"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=10, help="Round trips per client"
+    )
+    parser.add_argument(
+        "--create-requests",
+        type=int,
+        default=1,
+        help="Rooms created per client in the create scenario",
+    )
+    parser.add_argument(
+        "--rooms",
+        type=int,
+        default=1,
+        help="Rooms the message scenario spreads clients over",
+    )
+    parser.add_argument(
+        "--scenarios",
+        type=str,
+        default=",".join(SCENARIOS),
+        help=f"Comma separated subset of {','.join(SCENARIOS)}",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="loadtest-results.json",
+        help="File the JSON results are written to",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Earlier results file to compare against",
+    )
+
+    args = parser.parse_args()
+
+    scenarios = tuple(name.strip() for name in args.scenarios.split(",") if name)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    load_test = LoadTest(
+        url=args.url,
+        clients=args.clients,
+        requests=args.requests,
+        rooms=args.rooms,
+        scenarios=scenarios,
+        create_requests=args.create_requests,
+        hosting=args.hosting,
+        port=args.port,
+    )
+    results = asyncio.run(load_test.run())
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    logging.info(f"Results written to {args.output}")
+    print(json.dumps(results["scenarios"], indent=2))
+    if results["memory"]:
+        print(json.dumps(results["memory"], indent=2))
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            for line in compare(results, json.load(baseline_file)):
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
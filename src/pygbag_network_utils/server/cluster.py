@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import sys
+
+from ..codec import JSON
+
+WORKER_PATH = "/worker"
+# Worker processes started by the lobby read the registration token from here
+# rather than from their command line.
+TOKEN_ENV = "PYGBAG_WORKER_TOKEN"
+
+
+class WorkerError(Exception):
+    pass
+
+
+class RemoteRoom:
+    """
+    A room hosted by a worker process. It stands in for the BaseServer in
+    MainServer.echo_servers, so listing, joining and nuking rooms work the
+    same whether a room is local or remote.
+    """
+
+    # Clients of a remote room connect to the worker, never through the lobby.
+    routable = False
+
+    def __init__(self, worker, server_id, port):
+        self.worker = worker
+        self.server_id = server_id
+        self.host = worker.host
+        self.port = port
+        self.running = True
+
+    def get_client_count(self):
+        return self.worker.rooms.get(self.server_id, 0)
+
+    def request_stop(self):
+        self.running = False
+        self.worker.stop_room(self.server_id)
+
+
+class RemoteWorker:
+    """
+    Lobby side of a registered worker connection.
+
+    Tracks the rooms and clients the worker last reported and turns create
+    requests into awaitable replies.
+    """
+
+    def __init__(
+        self, worker_id, websocket, host, max_rooms=None, on_clients_changed=None
+    ):
+        self.worker_id = worker_id
+        self.websocket = websocket
+        self.host = host
+        self.max_rooms = max_rooms
+        # Called with (server_id, clients) for every room whose reported
+        # client count changed.
+        self.on_clients_changed = on_clients_changed
+        # Client count per room, as last reported by the worker.
+        self.rooms = {}
+        self.clients = 0
+        self.pending = {}
+        # Resolved by the worker's "drained" reply to drain_rooms().
+        self.drained = None
+        self.tasks = set()
+        self.logger = logging.getLogger(f"{self.__class__.__name__}-{worker_id}")
+
+    @property
+    def room_count(self):
+        return len(self.rooms) + len(self.pending)
+
+    @property
+    def load(self):
+        """Sort key for placement: fewest rooms first, then fewest clients."""
+        return self.room_count, self.clients
+
+    def has_capacity(self):
+        return self.max_rooms is None or self.room_count < self.max_rooms
+
+    async def send(self, data):
+        await self.websocket.send(JSON.frame(data))
+
+    async def create_room(self, server_id, timeout=10.0):
+        """Ask the worker to host room server_id and return it as a RemoteRoom."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending[server_id] = future
+        try:
+            await self.send({"command": "create", "server_id": server_id})
+            port = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise WorkerError(f"Worker {self.worker_id} did not create a room in time")
+        finally:
+            self.pending.pop(server_id, None)
+        self.rooms.setdefault(server_id, 0)
+        return RemoteRoom(self, server_id, port)
+
+    async def drain_rooms(self, server_ids, timeout=10.0):
+        """
+        Ask the worker to drain rooms server_ids and wait until their queued
+        frames are sent and their clients disconnected.
+        """
+        self.drained = asyncio.get_running_loop().create_future()
+        try:
+            await self.send({"command": "drain", "server_ids": list(server_ids)})
+            await asyncio.wait_for(self.drained, timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning("Worker did not drain its rooms in time")
+        finally:
+            self.drained = None
+
+    def release(self, room):
+        room.request_stop()
+
+    def stop_room(self, server_id):
+        self.rooms.pop(server_id, None)
+        task = asyncio.get_running_loop().create_task(
+            self.send({"command": "stop", "server_id": server_id})
+        )
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def handle_message(self, data):
+        command = data.get("command")
+        if command == "created":
+            future = self.pending.get(data["server_id"])
+            if future is not None and not future.done():
+                future.set_result(data["port"])
+            else:
+                # create_room() gave up waiting; nobody will ever stop it.
+                self.logger.warning(f"Stopping late room {data['server_id']}")
+                self.stop_room(data["server_id"])
+        elif command == "create_failed":
+            future = self.pending.get(data["server_id"])
+            if future is not None and not future.done():
+                future.set_exception(WorkerError(data.get("error", "Create failed")))
+        elif command == "drained":
+            if self.drained is not None and not self.drained.done():
+                self.drained.set_result(None)
+        elif command == "load":
+            reported = data.get("rooms")
+            if not isinstance(reported, dict):
+                reported = {}
+            rooms = {}
+            for server_id, count in reported.items():
+                try:
+                    rooms[int(server_id)] = count
+                except ValueError:
+                    self.logger.warning(f"Ignoring load of unknown room {server_id}")
+            if self.on_clients_changed is not None:
+                for server_id, count in rooms.items():
+                    if self.rooms.get(server_id) != count:
+                        self.on_clients_changed(server_id, count)
+            self.rooms = rooms
+            self.clients = data.get("clients", sum(self.rooms.values()))
+        else:
+            self.logger.warning(f"Unknown worker command: {command}")
+
+    def close(self):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(WorkerError("Worker disconnected"))
+        if self.drained is not None and not self.drained.done():
+            # Nothing is left to drain on a worker that is gone.
+            self.drained.set_result(None)
+        for task in list(self.tasks):
+            task.cancel()
+
+
+def class_path(cls):
+    """Return the "module:Class" path a worker process imports cls by."""
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+async def spawn_local_workers(
+    count,
+    lobby_url,
+    token,
+    game_server_class,
+    host="localhost",
+    port_base=10000,
+    warm_rooms=0,
+):
+    """
+    Start count worker processes on this machine. Worker i hosts its rooms on
+    ports from port_base + 1000 * i. game_server_class must be importable by
+    the workers, so it cannot live in a __main__ script.
+    """
+    env = dict(os.environ, **{TOKEN_ENV: token})
+    processes = []
+    for index in range(count):
+        processes.append(
+            await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "pygbag_network_utils.server.worker",
+                "--lobby",
+                lobby_url,
+                "--host",
+                host,
+                "--port-base",
+                str(port_base + 1000 * index),
+                "--max-rooms",
+                "1000",
+                "--warm-rooms",
+                str(warm_rooms),
+                "--game-server",
+                class_path(game_server_class),
+                env=env,
+            )
+        )
+    return processes
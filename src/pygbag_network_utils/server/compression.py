@@ -0,0 +1,121 @@
+import collections
+import dataclasses
+
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import CONT, CTRL_OPCODES
+
+
+class CompressedFrameCache:
+    """
+    Compressed payloads keyed by window bits and uncompressed payload, evicted
+    least recently used first. Without context takeover a payload always
+    compresses to the same bytes, so a frame broadcast to many clients is
+    compressed for the first one and copied for the rest.
+    """
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.payloads = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        data = self.payloads.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.payloads.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        self.payloads[key] = data
+        if len(self.payloads) > self.max_size:
+            self.payloads.popitem(last=False)
+
+
+class ThresholdDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that sends messages shorter than threshold bytes
+    uncompressed and, without context takeover, looks payloads up in a shared
+    CompressedFrameCache before compressing them.
+    """
+
+    def __init__(self, *args, threshold=0, cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+        # With context takeover the output depends on earlier messages.
+        self.cache = cache if self.local_no_context_takeover else None
+        self.skip_continuation = False
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is CONT:
+            if self.skip_continuation:
+                self.skip_continuation = not frame.fin
+                return frame
+            return super().encode(frame)
+        if len(frame.data) < self.threshold:
+            # Uncompressed messages leave the compression context alone.
+            self.skip_continuation = not frame.fin
+            return frame
+        if self.cache is None or not frame.fin:
+            return super().encode(frame)
+        key = (self.local_max_window_bits, bytes(frame.data))
+        data = self.cache.get(key)
+        if data is not None:
+            return dataclasses.replace(frame, data=data, rsv1=True)
+        encoded = super().encode(frame)
+        self.cache.put(key, bytes(encoded.data))
+        return encoded
+
+
+class CompressionFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate and hands out ThresholdDeflate extensions."""
+
+    def __init__(self, threshold=0, cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold
+        self.cache = cache
+
+    def process_request_params(self, params, accepted_extensions):
+        response, extension = super().process_request_params(
+            params, accepted_extensions
+        )
+        return response, ThresholdDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            threshold=self.threshold,
+            cache=self.cache,
+        )
+
+
+def server_extensions(server):
+    """
+    Return the websockets extensions for server's compression settings, an
+    empty list when server.compression is None.
+    """
+    if server.compression is None:
+        return []
+    if server.compression != "deflate":
+        raise ValueError(f"Unsupported compression: {server.compression}")
+    cache = None
+    if not server.compression_context_takeover and server.compression_cache_size:
+        cache = CompressedFrameCache(server.compression_cache_size)
+    return [
+        CompressionFactory(
+            threshold=server.compression_threshold,
+            cache=cache,
+            server_no_context_takeover=not server.compression_context_takeover,
+            server_max_window_bits=server.compression_window_bits,
+            client_max_window_bits=server.compression_window_bits,
+            compress_settings={"memLevel": server.compression_mem_level},
+        )
+    ]
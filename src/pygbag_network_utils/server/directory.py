@@ -0,0 +1,93 @@
+import collections
+import itertools
+
+
+class RoomDirectory:
+    """
+    Versioned listing of the lobby's rooms.
+
+    Entries are kept between list requests and changed in place, so a request
+    only costs the page it returns. Every change bumps version, carries the
+    new version number and goes into a bounded changelog. changes_since()
+    tells a client what it missed, or returns None once the changelog no
+    longer reaches back that far.
+
+    Rooms are added and removed right away. Client counts are only noted by
+    set_clients() and applied by flush(), so a burst of joins to one room
+    turns into a single change.
+    """
+
+    def __init__(self, history=1024):
+        self.entries = {}
+        self.version = 0
+        self.changelog = collections.deque(maxlen=history)
+        self.pending_clients = {}
+        # Changes since the last flush(), in order.
+        self.unpublished = []
+        self._ordered = None
+
+    def _record(self, change):
+        self.version += 1
+        change["version"] = self.version
+        self.changelog.append(change)
+        self.unpublished.append(change)
+
+    def add(self, room_id, address, clients=0):
+        entry = {"id": room_id, "address": address, "clients": clients}
+        self.entries[room_id] = entry
+        self._ordered = None
+        self._record({"op": "add", "room": dict(entry)})
+
+    def remove(self, room_id):
+        self.pending_clients.pop(room_id, None)
+        if self.entries.pop(room_id, None) is not None:
+            self._ordered = None
+            self._record({"op": "remove", "id": room_id})
+
+    def set_clients(self, room_id, clients):
+        self.pending_clients[room_id] = clients
+
+    def flush(self):
+        """Apply the noted client counts and return the unpublished changes."""
+        for room_id, clients in self.pending_clients.items():
+            entry = self.entries.get(room_id)
+            if entry is not None and entry["clients"] != clients:
+                entry["clients"] = clients
+                self._record({"op": "update", "id": room_id, "clients": clients})
+        self.pending_clients.clear()
+        changes = self.unpublished
+        self.unpublished = []
+        return changes
+
+    def changes_since(self, version):
+        """Return the changes after version, or None if they are not all kept."""
+        if version == self.version:
+            return []
+        if not self.changelog or not 0 <= version < self.version:
+            return None
+        # Versions in the changelog are consecutive.
+        start = version + 1 - self.changelog[0]["version"]
+        if start < 0:
+            return None
+        return list(itertools.islice(self.changelog, start, None))
+
+    def rooms(self):
+        if self._ordered is None:
+            self._ordered = tuple(self.entries.values())
+        return self._ordered
+
+    def listing(self, offset=0, limit=None, min_clients=None, max_clients=None):
+        """Return one page of the rooms matching the filters, and their total."""
+        rooms = self.rooms()
+        if min_clients is not None or max_clients is not None:
+            rooms = [
+                room
+                for room in rooms
+                if (min_clients is None or room["clients"] >= min_clients)
+                and (max_clients is None or room["clients"] <= max_clients)
+            ]
+        end = None if limit is None else offset + limit
+        return list(rooms[offset:end]), len(rooms)
+
+    def __len__(self):
+        return len(self.entries)
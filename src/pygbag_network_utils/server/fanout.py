@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import logging
+
+import websockets
+
+from ..codec import JSON
+
+# What a ClientChannel does with a new frame when its queue is full.
+DROP_OLDEST = "drop_oldest"  # Discard the oldest queued frame.
+COALESCE = "coalesce"  # Discard everything queued and keep only the newest frame.
+DISCONNECT = "disconnect"  # Close the connection of the slow client.
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class ClientChannel:
+    """
+    Bounded outbound queue for one client, drained by its own writer task.
+
+    put() never waits, so a slow client only delays its own frames instead of
+    stalling whoever is broadcasting.
+    """
+
+    def __init__(
+        self, websocket, max_size=256, overflow_policy=DROP_OLDEST, metrics=None
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.queue = collections.deque()
+        # Codec of the last message received from this client, used for replies.
+        self.codec = JSON
+        self.dropped = 0
+        self.closed = False
+        # Closes the connection of a client disconnected for overflowing.
+        self.close_task = None
+        self.metrics = metrics
+        # Frames written so far and, for clients with a resumable session, the
+        # most recent of them so they can be replayed after a reconnect.
+        self.sent = 0
+        self.replay = None
+        self.replay_size = 0
+        self.session = None
+        self.session_start = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._wakeup = asyncio.Event()
+        # Set while the writer has nothing left to send or has stopped.
+        self._idle = asyncio.Event()
+        self._writer_task = asyncio.get_running_loop().create_task(self._writer())
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def put(self, frame):
+        """Queue an encoded frame. Returns False if the frame was not queued."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_size:
+            if self.overflow_policy == DROP_OLDEST:
+                self.queue.popleft()
+                self.count_dropped(1)
+            elif self.overflow_policy == COALESCE:
+                self.count_dropped(len(self.queue))
+                self.queue.clear()
+            else:
+                self.logger.info(
+                    f"Disconnecting {self.websocket.remote_address}: outbound queue full"
+                )
+                self.close()
+                # Keep a reference so the task is not garbage-collected early.
+                self.close_task = asyncio.get_running_loop().create_task(
+                    self.websocket.close(1008, "Outbound queue overflow")
+                )
+                return False
+        self.queue.append(frame)
+        self._wakeup.set()
+        if not self._writer_task.done():
+            self._idle.clear()
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue and self.session_start is None:
+                    self._idle.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                if self.session_start is not None:
+                    frame, base, history = self.session_start
+                    await self.websocket.send(frame)
+                    # Count and record frames from the session reply on, so
+                    # the server and the client agree on the numbering.
+                    self.session_start = None
+                    self.sent = base
+                    self.replay = collections.deque(history, maxlen=self.replay_size)
+                    continue
+                frame = self.queue.popleft()
+                # Record the frame before sending: if the connection drops
+                # halfway, the client's received count tells what to replay.
+                self.sent += 1
+                if self.replay is not None:
+                    self.replay.append(frame)
+                await self.websocket.send(frame)
+                if self.metrics is not None:
+                    self.metrics.record_out(len(frame))
+        except websockets.exceptions.ConnectionClosed:
+            self.logger.debug("Client disconnected while sending.")
+        except Exception as e:
+            self.logger.error(f"Error sending message to client: {e}")
+        finally:
+            self._idle.set()
+            if self.session is None:
+                self.closed = True
+
+    async def drain(self):
+        """Wait until every queued frame is sent or the writer has stopped."""
+        if not self._writer_task.done():
+            await self._idle.wait()
+
+    def count_dropped(self, count):
+        self.dropped += count
+        if self.metrics is not None:
+            self.metrics.inc("frames_dropped", count)
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self._writer_task.cancel()
+
+    def suspend(self):
+        """
+        Stop writing but keep the replay buffer, and keep queueing new frames
+        so a resumed client receives them too.
+        """
+        self._writer_task.cancel()
+
+    def missed_frames(self, received):
+        """
+        Return the frames a client that received the first `received` frames
+        of the session has not seen yet, or None if some of them are no longer
+        buffered.
+        """
+        replayable = len(self.replay) if self.replay is not None else 0
+        oldest = self.sent - replayable
+        if received < oldest or received > self.sent:
+            return None
+        missed = list(self.replay)[received - oldest :] if replayable else []
+        return missed + list(self.queue)
+
+    def start_session(self, token, reply, replay_size, old=None, received=0):
+        """
+        Send the session reply ahead of everything queued. When resuming the
+        suspended channel old, the frames the client missed follow it instead
+        of what was queued on this connection so far: old went on queueing the
+        same broadcasts, so sending both would repeat them.
+        """
+        history = []
+        if old is not None:
+            missed = old.missed_frames(received)
+            if old.replay:
+                seen = len(old.replay) - (old.sent - received)
+                history = list(old.replay)[:seen]
+            self.queue.clear()
+            self.queue.extend(missed)
+        self.session = token
+        self.replay_size = replay_size
+        self.session_start = (reply, received if old is not None else 0, history)
+        self._idle.clear()
+        self._wakeup.set()
@@ -1,19 +1,113 @@
 import asyncio
-import json
+import concurrent.futures
 import logging
-import threading
+import secrets
+import time
 import websockets
 
+from ..codec import DecodeError, detect_codec
+from .compression import server_extensions
+from .fanout import DROP_OLDEST, ClientChannel
+from .inputs import InputQueue
+from .limits import CLOSE_POLICY_VIOLATION, ConnectionLimiter
+from .metrics import Metrics
+from .registry import Registry
+from .tick import TickScheduler
+
 
 class BaseServer:
+    # Outbound frames queued per client before overflow_policy kicks in.
+    outbound_queue_size = 256
+    # One of fanout.DROP_OLDEST, fanout.COALESCE or fanout.DISCONNECT.
+    overflow_policy = DROP_OLDEST
+    # Ticks per second for the built-in fixed timestep game loop. Leave at
+    # None to write game_loop yourself.
+    tick_rate = None
+    # Most late ticks run back to back before the rest are skipped.
+    max_catch_up_ticks = 5
+    # Drop deferred work instead of carrying it over when a tick overruns.
+    shed_on_overrun = False
+    # Queue {"input": ..., "seq": n} messages and hand them to handle_inputs
+    # once per tick instead of to handle_client_message. Needs tick_rate.
+    # Each client may have max_pending_inputs waiting for the next tick.
+    batch_inputs = False
+    max_pending_inputs = 32
+    # Seconds a disconnected client's session can be resumed for (0 disables
+    # sessions) and how many sent frames are kept to replay on resume.
+    session_ttl = 30
+    replay_buffer_size = 128
+    # Largest incoming message in bytes. Bigger frames close the connection
+    # (1009) before anything is decoded.
+    max_message_size = 2**16
+    # Messages per second each client may send on average and the burst it
+    # may send at once (rate_limit None disables the limit), and how many
+    # rejected messages in a row get the client disconnected.
+    rate_limit = 120
+    rate_limit_burst = 240
+    rate_limit_strikes = 100
+    # Extra per-command limits, {command: (rate, burst)}, checked with
+    # allow_command().
+    command_rate_limits = {}
+    # Outgoing permessage-deflate; None sends everything uncompressed. More
+    # window bits (9-15) and a higher memory level (1-9) compress better but
+    # hold more memory per connection. Messages shorter than
+    # compression_threshold bytes are not worth compressing. Without context
+    # takeover each message is compressed on its own: the ratio drops a
+    # little, no compressor stays allocated between messages, and a frame
+    # broadcast to many clients is compressed once and shared through a cache
+    # of compression_cache_size frames.
+    compression = "deflate"
+    compression_window_bits = 12
+    compression_mem_level = 5
+    compression_threshold = 128
+    compression_context_takeover = True
+    compression_cache_size = 64
+    # Seconds drain() gives connected clients to leave on their own, and
+    # how long it then waits for their queued frames to be sent.
+    drain_timeout = 10
+    flush_timeout = 5
+
     def __init__(self, host, port, ssl_context=None):
         self.host = host
+        # None runs the server without a listener of its own; clients then
+        # only reach it through a lobby that routes connections to it.
         self.port = port
-        self.clients = set()
-        self.lock = threading.Lock()
+        # Both registries belong to the server's event loop. clients holds
+        # the connected websockets; channels also keeps the channels of
+        # suspended sessions so they go on receiving broadcasts.
+        self.clients = Registry()
+        self.channels = Registry()
+        self.sessions = {}
+        self.suspended_sessions = {}
+        self.limiters = {}
         self.running = True
         self.logger = logging.getLogger(self.__class__.__name__)
         self.ssl_context = ssl_context
+        self.loop = None
+        self.server = None
+        self.stopped = None
+        self.game_loop_task = None
+        # Thread-safe futures, so hosts on other loops can wait on them:
+        # ready resolves once the server is listening (or fails with the
+        # error that kept it from starting), finished once start() returns.
+        self.ready = concurrent.futures.Future()
+        self.finished = concurrent.futures.Future()
+        # Set by enable_metrics(); None keeps instrumentation off.
+        self.metrics = None
+        # Called with the server, on its own loop, whenever a client joins or
+        # leaves. The lobby uses it to keep its room listing current.
+        self.on_clients_changed = None
+        self.scheduler = None
+        self.inputs = None
+        if self.tick_rate and self.batch_inputs:
+            self.inputs = InputQueue(self.max_pending_inputs)
+        if self.tick_rate:
+            self.scheduler = TickScheduler(
+                self.tick_rate,
+                self.run_tick if self.inputs is not None else self.tick,
+                self.max_catch_up_ticks,
+                self.shed_on_overrun,
+            )
 
     async def handle_client_message(self, websocket, message):
         """
@@ -25,27 +119,294 @@ class BaseServer:
 
     async def game_loop(self):
         """
-        Override this method in a subclass to define custom game loop behavior.
+        Override this method in a subclass to define custom game loop behavior,
+        or set tick_rate and implement tick instead.
         """
-        raise NotImplementedError("You must implement game_loop in your subclass!")
+        if self.scheduler is None:
+            raise NotImplementedError("You must implement game_loop in your subclass!")
+        await self.scheduler.run(lambda: self.running)
 
-    async def handle_client(self, websocket):
-        with self.lock:
-            self.clients.add(websocket)
-            self.logger.info(
-                f"Client connected to server at {self.host}:{self.port}. Total clients: {len(self.clients)}"
+    async def tick(self, dt):
+        """
+        Override this method in a subclass to advance the game by dt seconds.
+        Called tick_rate times per second when tick_rate is set.
+        """
+        raise NotImplementedError("You must implement tick in your subclass!")
+
+    async def handle_inputs(self, batch):
+        """
+        Override this method when batch_inputs is set. Called at the start of
+        every tick that received inputs, with {websocket: [(seq, input), ...]}
+        in arrival order of the clients and seq order per client.
+        """
+        raise NotImplementedError("You must implement handle_inputs in your subclass!")
+
+    async def run_tick(self, dt):
+        """Apply the inputs received since the last tick, then run the tick."""
+        batch = self.inputs.drain()
+        if batch:
+            await self.handle_inputs(batch)
+        await self.tick(dt)
+
+    def defer(self, callback):
+        """
+        Run non-critical work after the current tick if the tick budget allows.
+        Only available when tick_rate is set.
+        """
+        self.scheduler.defer(callback)
+
+    def enable_metrics(self, sample_rate=0.1):
+        """
+        Collect message, byte and queue metrics in self.metrics. Handler and
+        broadcast durations are timed for a sample_rate fraction of calls.
+        """
+        metrics = self.metrics = Metrics(sample_rate)
+        metrics.gauge("clients", self.get_client_count)
+        metrics.gauge("suspended_sessions", lambda: len(self.suspended_sessions))
+        metrics.gauge(
+            "queue_depth",
+            lambda: sum(channel.depth for channel in self.channels.values()),
+        )
+        metrics.gauge(
+            "queue_depth_max",
+            lambda: max(
+                (channel.depth for channel in self.channels.values()), default=0
+            ),
+        )
+        for channel in self.channels.values():
+            channel.metrics = metrics
+
+    def get_metrics(self):
+        """Return a snapshot of the metrics, or None if they are not enabled."""
+        if self.metrics is None:
+            return None
+        snapshot = self.metrics.snapshot()
+        snapshot["tick"] = self.get_tick_stats()
+        return snapshot
+
+    def get_tick_stats(self):
+        """Return tick timing statistics, or None without a tick_rate."""
+        if self.scheduler is None:
+            return None
+        return self.scheduler.stats.snapshot()
+
+    def add_client(self, websocket):
+        channel = ClientChannel(
+            websocket, self.outbound_queue_size, self.overflow_policy, self.metrics
+        )
+        self.clients.add(websocket)
+        self.channels.add(websocket, channel)
+        self.limiters[websocket] = ConnectionLimiter(
+            self.rate_limit, self.rate_limit_burst, self.command_rate_limits
+        )
+        self.logger.info(
+            f"Client connected to server at {self.host}:{self.port}. Total clients: {len(self.clients)}"
+        )
+        if self.on_clients_changed is not None:
+            self.on_clients_changed(self)
+
+    def remove_client(self, websocket):
+        self.clients.discard(websocket)
+        self.limiters.pop(websocket, None)
+        channel = self.channels.get(websocket)
+        suspend = channel is not None and channel.session and self.session_ttl
+        if channel is not None and not suspend:
+            self.channels.discard(websocket)
+        if self.inputs is not None and not suspend:
+            self.inputs.remove(websocket)
+        self.logger.info(
+            f"Client disconnected from server at {self.host}:{self.port}. Total clients: {len(self.clients)}"
+        )
+        if self.on_clients_changed is not None:
+            self.on_clients_changed(self)
+        if channel is None:
+            return
+        if suspend:
+            # The channel stays in self.channels so broadcasts keep queueing
+            # for the client until it resumes or the session expires.
+            channel.suspend()
+            self.sessions.pop(channel.session, None)
+            self.suspended_sessions[channel.session] = (
+                channel,
+                time.monotonic() + self.session_ttl,
+            )
+            self.expire_sessions()
+        else:
+            channel.close()
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        for token, (channel, expires_at) in list(self.suspended_sessions.items()):
+            if expires_at <= now:
+                self.drop_suspended_session(token)
+
+    def drop_suspended_session(self, token, close=True):
+        channel, _ = self.suspended_sessions.pop(token)
+        self.channels.discard(channel.websocket)
+        if self.inputs is not None:
+            self.inputs.remove(channel.websocket)
+        if close:
+            channel.close()
+        return channel
+
+    async def handle_session_message(self, websocket, message):
+        """
+        Handle a session handshake sent as the first message of a connection:
+        {"session": null} starts a resumable session and
+        {"session": <token>, "received": <count>} resumes one, replaying the
+        frames the client missed. Returns False for any other message.
+        """
+        marker = "session" if isinstance(message, str) else b"session"
+        if marker not in message:
+            return False
+        try:
+            codec = detect_codec(message)
+            data = codec.decode(message)
+        except DecodeError:
+            return False
+        if not isinstance(data, dict) or "session" not in data:
+            return False
+
+        channel = self.channels.get(websocket)
+        if channel is None:
+            return True
+        channel.codec = codec
+        if not self.session_ttl:
+            # Sessions are disabled; tell the client so it stops waiting.
+            reply = codec.frame({"session": None, "resumed": False})
+            channel.start_session(None, reply, 0)
+            return True
+        self.expire_sessions()
+        token = data["session"] if isinstance(data["session"], str) else None
+        received = data.get("received", 0)
+        if not isinstance(received, int):
+            received = 0
+        old = None
+        if token in self.sessions:
+            # The client reconnected before its old connection was noticed dead.
+            old_websocket = self.sessions[token].websocket
+            self.remove_client(old_websocket)
+            asyncio.get_running_loop().create_task(old_websocket.close())
+        if token in self.suspended_sessions:
+            if self.inputs is not None:
+                # Keep dropping inputs the old connection already delivered.
+                old_websocket = self.suspended_sessions[token][0].websocket
+                self.inputs.move_client(old_websocket, websocket)
+            old = self.drop_suspended_session(token, close=False)
+            if old.missed_frames(received) is None:
+                old.close()
+                old = None
+
+        if old is None:
+            token = secrets.token_urlsafe(16)
+        self.sessions[token] = channel
+        reply = codec.frame({"session": token, "resumed": old is not None})
+        channel.start_session(token, reply, self.replay_buffer_size, old, received)
+        if old is not None:
+            old.close()
+            self.logger.info(f"Resumed session for {websocket.remote_address}")
+            await self.on_session_resumed(old.websocket, websocket)
+        return True
+
+    async def on_session_resumed(self, old_websocket, websocket):
+        """
+        Override this method in a subclass to move per-client game state from
+        the old connection of a resumed session to the new one.
+        """
+
+    def allow_message(self, websocket):
+        """Take a message from the client's rate limit; False if it is used up."""
+        limiter = self.limiters.get(websocket)
+        return limiter is None or limiter.allow_message()
+
+    def allow_command(self, websocket, command):
+        """Like allow_message, for the limits in command_rate_limits."""
+        limiter = self.limiters.get(websocket)
+        return limiter is None or limiter.allow_command(command)
+
+    async def reject_message(self, websocket):
+        """
+        Handle a message that went over the rate limit. The client is told
+        once per streak of rejections and disconnected after
+        rate_limit_strikes of them. Returns True if it was disconnected.
+        """
+        limiter = self.limiters.get(websocket)
+        if self.metrics is not None:
+            self.metrics.inc("rate_limited")
+        if limiter is None:
+            return False
+        if limiter.strikes == 1:
+            self.send_data(websocket, {"error": "Rate limit exceeded"})
+        if limiter.strikes < self.rate_limit_strikes:
+            return False
+        self.logger.warning(
+            f"Disconnecting {websocket.remote_address}: rate limit exceeded"
+        )
+        await websocket.close(CLOSE_POLICY_VIOLATION, "Rate limit exceeded")
+        return True
+
+    async def dispatch_message(self, websocket, message):
+        """
+        Hand one message to handle_client_message. Used both by handle_client and
+        by MainServer when it routes a message from a lobby connection.
+        """
+        metrics = self.metrics
+        start = None
+        if metrics is not None:
+            metrics.record_in(len(message))
+        if self.inputs is not None and self.queue_input(websocket, message):
+            return
+        if metrics is not None:
+            start = metrics.timer()
+        try:
+            await self.handle_client_message(websocket, message)
+            if start is not None:
+                metrics.observe_since(
+                    "handler_seconds", start, handler=self.__class__.__name__
+                )
+        except Exception as e:
+            self.logger.exception(
+                f"Unexpected error processing message from {websocket.remote_address}: {e}"
             )
+
+    def queue_input(self, websocket, message):
+        """
+        Queue an {"input": ..., "seq": n} message for the next tick. Returns
+        False for other messages. Stale and duplicate inputs are dropped.
+        """
+        marker = "input" if isinstance(message, str) else b"input"
+        if marker not in message:
+            return False
+        try:
+            data = self.decode_message(websocket, message)
+        except DecodeError:
+            return False
+        if not isinstance(data, dict) or "input" not in data:
+            return False
+        seq = data.get("seq")
+        valid = isinstance(seq, int) and not isinstance(seq, bool)
+        if not (valid and self.inputs.submit(websocket, seq, data["input"])):
+            if self.metrics is not None:
+                self.metrics.inc("inputs_dropped")
+        return True
+
+    async def handle_client(self, websocket):
+        self.add_client(websocket)
+        first_message = True
         try:
             async for message in websocket:
                 if not self.running:
                     self.logger.info("Server stopped. Closing connection.")
                     break
-                try:
-                    await self.handle_client_message(websocket, message)
-                except Exception as e:
-                    self.logger.exception(
-                        f"Unexpected error processing message from {websocket.remote_address}: {e}"
-                    )
+                if first_message:
+                    first_message = False
+                    if await self.handle_session_message(websocket, message):
+                        continue
+                if not self.allow_message(websocket):
+                    if await self.reject_message(websocket):
+                        break
+                    continue
+                await self.dispatch_message(websocket, message)
         except websockets.exceptions.ConnectionClosedError:
             self.logger.info(
                 f"Client disconnected from server at {self.host}:{self.port}"
@@ -53,73 +414,239 @@ class BaseServer:
         except Exception as e:
             self.logger.exception(f"Error handling client: {e}")
         finally:
-            with self.lock:
-                self.clients.remove(websocket)
-                self.logger.info(
-                    f"Client disconnected from server at {self.host}:{self.port}. Total clients: {len(self.clients)}"
-                )
+            self.remove_client(websocket)
+
+    def queue_message(self, websocket, message):
+        """
+        Queue a message for one client behind anything already queued for it.
+        Returns False if the client is gone or its queue overflowed.
+        """
+        channel = self.channels.get(websocket)
+        if channel is None:
+            return False
+        return channel.put(message + "\n")  # Append newline character here
 
     async def broadcast(self, message):
-        disconnected_clients = []
-        for client in self.clients:
-            try:
-                await client.send(message + "\n")  # Append newline character here
-            except websockets.exceptions.ConnectionClosedError:
-                self.logger.info("Client disconnected during broadcast.")
-                disconnected_clients.append(client)
-            except Exception as e:
-                self.logger.error(f"Error sending message to client: {e}")
-                disconnected_clients.append(client)
-
-        # Remove disconnected clients after iteration to avoid modifying set during iteration
-        with self.lock:
-            for client in disconnected_clients:
-                self.clients.remove(client)
+        """
+        Queue a message for every client. The frame is built once and each
+        client's writer sends it on its own, so slow clients do not hold up
+        the caller or each other.
+        """
+        start = self.metrics.timer() if self.metrics is not None else None
+        frame = message + "\n"
+        for channel in self.channels.values():
+            channel.put(frame)
+        if start is not None:
+            self.metrics.observe_since("broadcast_seconds", start)
+
+    def decode_message(self, websocket, message):
+        """
+        Decode an incoming message with the codec it was sent in. Later
+        send_data and broadcast_data calls answer the client in that codec.
+        Raises codec.DecodeError for malformed messages.
+        """
+        codec = detect_codec(message)
+        channel = self.channels.get(websocket)
+        if channel is not None:
+            channel.codec = codec
+        return codec.decode(message)
+
+    def send_data(self, websocket, data):
+        """Encode data in the client's codec and queue it for that client."""
+        channel = self.channels.get(websocket)
+        if channel is None:
+            return False
+        return channel.put(channel.codec.frame(data))
+
+    async def broadcast_data(self, data):
+        """Like broadcast, encoding data once per codec in use by the clients."""
+        start = self.metrics.timer() if self.metrics is not None else None
+        frames = {}
+        for channel in self.channels.values():
+            frame = frames.get(channel.codec.name)
+            if frame is None:
+                frame = frames[channel.codec.name] = channel.codec.frame(data)
+            channel.put(frame)
+        if start is not None:
+            self.metrics.observe_since("broadcast_seconds", start)
+
+    def get_queue_depths(self):
+        """Return the number of frames waiting to be sent, per client."""
+        return {
+            websocket: channel.depth for websocket, channel in self.channels.items()
+        }
 
     async def start(self):
+        if not self.running:
+            self._resolve(self.ready, error=RuntimeError("Server was stopped"))
+            self._resolve(self.finished)
+            return
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
         try:
-            self.server = await websockets.serve(
-                self.handle_client, self.host, self.port, ssl=self.ssl_context
-            )
-            self.logger.info(f"Server started on ws://{self.host}:{self.port}")
+            if self.port is not None:
+                self.server = await websockets.serve(
+                    self.handle_client,
+                    self.host,
+                    self.port,
+                    ssl=self.ssl_context,
+                    max_size=self.max_message_size,
+                    compression=None,
+                    extensions=server_extensions(self),
+                )
+                self.logger.info(f"Server started on ws://{self.host}:{self.port}")
+            else:
+                self.logger.info("Server started without a listener")
+            self._resolve(self.ready)
             # Start the game loop task
             self.game_loop_task = asyncio.create_task(self.game_loop())
-            await self.server.wait_closed()
+            if self.server is not None:
+                await self.server.wait_closed()
+            else:
+                await self.stopped.wait()
             await self.game_loop_task
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
             self.logger.error(f"Error starting server: {e}")
+            self._resolve(self.ready, error=e)
+        finally:
+            self._resolve(self.ready, error=RuntimeError("Server stopped"))
+            self._resolve(self.finished)
+
+    @staticmethod
+    def _resolve(future, error=None):
+        if future.done():
+            return
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    async def wait_ready(self, timeout=None):
+        """Wait, from any event loop, until the server accepts connections."""
+        await asyncio.wait_for(asyncio.wrap_future(self.ready), timeout)
+
+    async def stop(self):
+        """Stop accepting clients, close the listener and end the game loop."""
+        self.running = False
+        if self.server is not None:
+            self.server.close()
+        if self.stopped is not None:
+            self.stopped.set()
+        if self.game_loop_task is not None:
+            self.game_loop_task.cancel()
+
+    async def flush(self, timeout=None):
+        """Wait until the frames queued for every client are sent."""
+        drains = [channel.drain() for channel in self.channels.values()]
+        try:
+            await asyncio.wait_for(asyncio.gather(*drains), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning("Gave up flushing outbound queues")
+
+    async def drain(self, timeout=None):
+        """
+        Stop without cutting clients off: stop accepting connections, give
+        the connected clients up to timeout seconds (drain_timeout by
+        default) to leave, let a running tick finish, send what is queued and
+        close the remaining connections with 1001 (going away).
+        """
+        if timeout is None:
+            timeout = self.drain_timeout
+        if self.server is not None:
+            self.server.close(close_connections=False)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.clients and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        self.running = False
+        if self.scheduler is not None and self.scheduler.ticking:
+            # The tick ends the game loop once it is done.
+            await asyncio.wait({self.game_loop_task}, timeout=self.flush_timeout)
+        await self.flush(self.flush_timeout)
+        await asyncio.gather(
+            *(
+                websocket.close(1001, "Server shutting down")
+                for websocket in self.clients.keys()
+            ),
+            return_exceptions=True,
+        )
+        await self.stop()
+
+    def request_drain(self, timeout=None):
+        """
+        Drain the server from any thread. Returns a future that can be
+        awaited with asyncio.wrap_future(), or None if it is not running.
+        """
+        return self._run_on_loop(lambda: self.drain(timeout))
+
+    def request_stop(self):
+        """
+        Stop the server from any thread. The stop is scheduled on the loop the
+        server runs on; a server that has not started yet will not start.
+        """
+        self.running = False
+        self._run_on_loop(self.stop)
+
+    def reset(self):
+        """
+        Override this method in a subclass to clear game state before an
+        empty room is handed out again by a RoomPool.
+        """
+
+    async def recycle(self):
+        """Drop what is left of the previous room's clients and reset it."""
+        for token in list(self.suspended_sessions):
+            self.drop_suspended_session(token)
+        self.reset()
+
+    def request_recycle(self):
+        """Recycle the server from any thread, like request_stop."""
+        self._run_on_loop(self.recycle)
+
+    def _run_on_loop(self, coroutine_function):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            return loop.create_task(coroutine_function())
+        return asyncio.run_coroutine_threadsafe(coroutine_function(), loop)
 
     def get_client_count(self):
-        with self.lock:
-            return len(self.clients)
+        """Number of connected clients. Safe to call from any thread."""
+        return len(self.clients)
 
 
 # Example of a subclass inheriting from BaseServer
 class EchoServer(BaseServer):
+    tick_rate = 1
+
     async def handle_client_message(self, websocket, message):
         """
         Custom behavior for handling client messages.
         """
         try:
-            data = json.loads(message)
+            data = self.decode_message(websocket, message)
             data["echo"] = data["message"]
             del data["message"]
-            response = json.dumps(data)
-            await websocket.send(response + "\n")
-        except json.JSONDecodeError as e:
-            self.logger.error(f"JSONDecodeError: {e}")
-            await websocket.send(json.dumps({"error": "Invalid JSON format"}) + "\n")
+            self.send_data(websocket, data)
+        except DecodeError as e:
+            self.logger.error(f"DecodeError: {e}")
+            self.send_data(websocket, {"error": f"Invalid {e.codec.upper()} format"})
         except KeyError as e:
             self.logger.error(f"KeyError: {e}")
-            await websocket.send(json.dumps({"error": f"Missing key: {e}"}) + "\n")
+            self.send_data(websocket, {"error": f"Missing key: {e}"})
 
-    async def game_loop(self):
+    async def tick(self, dt):
         """
-        Custom game loop behavior.
+        Custom game loop behavior, run once per second.
         """
-        while self.running:
-            await asyncio.sleep(1)  # Simulate some periodic task
-            await self.broadcast(json.dumps({"echo": "Game loop"}))
+        await self.broadcast_data({"echo": "Game loop"})
 
 
 # Example usage
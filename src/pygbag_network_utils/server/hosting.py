@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import threading
+
+
+class ThreadHost:
+    """
+    Runs every game server on its own thread with its own event loop.
+
+    This is the original hosting model. It is kept for game servers that block
+    their loop and therefore cannot share one with other rooms.
+    """
+
+    name = "thread"
+    # Whether rooms share the main server loop, so lobby connections can be
+    # routed to them directly.
+    routable = False
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def spawn(self, server):
+        thread = threading.Thread(target=asyncio.run, args=(server.start(),))
+        thread.daemon = (
+            True  # Allow main program to exit even if thread is still running
+        )
+        thread.start()
+        return thread
+
+    def stop(self, server):
+        server.request_stop()
+
+    def shutdown(self):
+        pass
+
+
+class SharedLoopHost:
+    """
+    Runs every game server as tasks on the event loop of the main server.
+
+    Rooms cost one task for the listener and one for the game loop instead of
+    an OS thread and an event loop each.
+    """
+
+    name = "shared"
+    routable = True
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.tasks = set()
+
+    def spawn(self, server):
+        task = asyncio.get_running_loop().create_task(server.start())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def stop(self, server):
+        server.request_stop()
+
+    def shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+
+class LoopPoolHost:
+    """
+    Spreads game servers across a fixed pool of event loops, one per worker
+    thread. New rooms are placed on the loop hosting the fewest rooms.
+    """
+
+    name = "pool"
+    routable = False
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.loops = []
+        self.threads = []
+        self.load = []
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _run_loop(self, loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def _ensure_started(self):
+        if self.loops:
+            return
+        for index in range(self.workers):
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=self._run_loop,
+                args=(loop,),
+                name=f"game-loop-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self.loops.append(loop)
+            self.threads.append(thread)
+            self.load.append(0)
+        self.logger.info(f"Started {self.workers} game server loops")
+
+    def _release(self, index):
+        with self._lock:
+            self.load[index] -= 1
+
+    def spawn(self, server):
+        with self._lock:
+            self._ensure_started()
+            index = min(range(len(self.loops)), key=self.load.__getitem__)
+            self.load[index] += 1
+        future = asyncio.run_coroutine_threadsafe(server.start(), self.loops[index])
+        future.add_done_callback(lambda _: self._release(index))
+        return future
+
+    def stop(self, server):
+        server.request_stop()
+
+    def shutdown(self):
+        for loop in self.loops:
+            loop.call_soon_threadsafe(loop.stop)
+        for thread in self.threads:
+            thread.join()
+        self.loops.clear()
+        self.threads.clear()
+        self.load.clear()
+
+
+HOSTS = {
+    ThreadHost.name: ThreadHost,
+    SharedLoopHost.name: SharedLoopHost,
+    LoopPoolHost.name: LoopPoolHost,
+}
+
+
+def create_host(hosting="shared", workers=None):
+    """
+    Build a host from its name ("shared", "pool" or "thread"). Host instances
+    are returned unchanged so callers can pass in their own.
+    """
+    if not isinstance(hosting, str):
+        return hosting
+    try:
+        host_class = HOSTS[hosting]
+    except KeyError:
+        raise ValueError(f"Unknown hosting mode: {hosting}") from None
+    if host_class is LoopPoolHost:
+        return host_class(workers)
+    return host_class()
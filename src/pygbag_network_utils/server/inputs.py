@@ -0,0 +1,69 @@
+import collections
+
+
+class InputQueue:
+    """
+    Collects numbered client inputs between ticks.
+
+    Clients send {"input": ..., "seq": n} with n increasing by one per input,
+    as client.prediction.InputPredictor does. submit() only queues an input;
+    drain() hands the tick everything received since the last drain, grouped
+    by client and ordered by seq. Inputs at or below the highest seq already
+    accepted from a client are duplicates or stale and are dropped, as are
+    the oldest queued inputs of a client that has more than max_pending
+    waiting.
+    """
+
+    def __init__(self, max_pending=32):
+        self.max_pending = max_pending
+        self.pending = {}
+        # Highest seq accepted and highest seq handed to the tick, per client.
+        self.accepted = {}
+        self.processed_seq = {}
+        self.dropped = 0
+
+    def submit(self, client, seq, input):
+        """Queue an input. Returns False if it was dropped."""
+        if seq <= self.accepted.get(client, 0):
+            self.dropped += 1
+            return False
+        self.accepted[client] = seq
+        queue = self.pending.get(client)
+        if queue is None:
+            queue = self.pending[client] = collections.deque()
+        # Accepted seqs only grow, so the queue stays in seq order.
+        queue.append((seq, input))
+        if len(queue) > self.max_pending:
+            queue.popleft()
+            self.dropped += 1
+        return True
+
+    def drain(self):
+        """
+        Return the inputs received since the last drain, as {client: [(seq,
+        input), ...]} in the order the clients' first inputs arrived.
+        """
+        batch = self.pending
+        self.pending = {}
+        for client, queue in batch.items():
+            self.processed_seq[client] = queue[-1][0]
+            batch[client] = list(queue)
+        return batch
+
+    def processed(self, client):
+        """
+        The highest seq of client handed to a tick so far, 0 before any. Send
+        it with the state so the client can reconcile its prediction.
+        """
+        return self.processed_seq.get(client, 0)
+
+    def move_client(self, old, new):
+        """Carry a client's sequence state over to a resumed connection."""
+        for mapping in (self.pending, self.accepted, self.processed_seq):
+            if old in mapping:
+                mapping[new] = mapping.pop(old)
+
+    def remove(self, client):
+        self.pending.pop(client, None)
+        self.accepted.pop(client, None)
+        self.processed_seq.pop(client, None)
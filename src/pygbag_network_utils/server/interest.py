@@ -0,0 +1,130 @@
+import math
+
+
+class SpatialGrid:
+    """
+    Uniform grid of keyed points.
+
+    Each point lives in the cell covering it. update() only touches the cell
+    sets when a point crosses into another cell, so moving inside a cell is a
+    dict write. query() looks at the cells overlapping the search radius
+    instead of every point.
+    """
+
+    def __init__(self, cell_size):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = cell_size
+        self.cells = {}
+        # Maps each key to its (x, y, cell).
+        self.positions = {}
+
+    def cell_of(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def update(self, key, x, y):
+        cell = self.cell_of(x, y)
+        previous = self.positions.get(key)
+        if previous is None or previous[2] != cell:
+            if previous is not None:
+                self._leave(key, previous[2])
+            self.cells.setdefault(cell, set()).add(key)
+        self.positions[key] = (x, y, cell)
+
+    def remove(self, key):
+        previous = self.positions.pop(key, None)
+        if previous is not None:
+            self._leave(key, previous[2])
+
+    def _leave(self, key, cell):
+        members = self.cells[cell]
+        members.discard(key)
+        if not members:
+            del self.cells[cell]
+
+    def position(self, key):
+        """Return the (x, y) of key, or None if it is not in the grid."""
+        entry = self.positions.get(key)
+        return None if entry is None else entry[:2]
+
+    def query(self, x, y, radius):
+        """Return the keys within radius of (x, y)."""
+        low_x, low_y = self.cell_of(x - radius, y - radius)
+        high_x, high_y = self.cell_of(x + radius, y + radius)
+        limit = radius * radius
+        found = []
+        for cell_x in range(low_x, high_x + 1):
+            for cell_y in range(low_y, high_y + 1):
+                members = self.cells.get((cell_x, cell_y))
+                if not members:
+                    continue
+                for key in members:
+                    key_x, key_y, _ = self.positions[key]
+                    if (key_x - x) ** 2 + (key_y - y) ** 2 <= limit:
+                        found.append(key)
+        return found
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class InterestManager:
+    """
+    Area-of-interest filtering for the clients of a BaseServer.
+
+    Each client has a position, usually that of its avatar, set with
+    set_position(). broadcast_near() and broadcast_data_near() send an update
+    about something at (x, y) only to the clients within radius of it,
+    instead of to the whole room. Clients without a position receive nothing
+    from them. Clients that leave the server are dropped on the next query,
+    or right away with remove().
+    """
+
+    def __init__(self, server, radius, cell_size=None):
+        self.server = server
+        self.radius = radius
+        # Cells as large as the radius keep a query to a 3x3 block of cells.
+        self.grid = SpatialGrid(cell_size or radius)
+
+    def set_position(self, websocket, x, y):
+        self.grid.update(websocket, x, y)
+
+    def remove(self, websocket):
+        self.grid.remove(websocket)
+
+    def clients_near(self, x, y):
+        """Return the channels of the clients interested in (x, y)."""
+        channels = []
+        for websocket in self.grid.query(x, y, self.radius):
+            channel = self.server.channels.get(websocket)
+            if channel is None:
+                self.grid.remove(websocket)
+            else:
+                channels.append(channel)
+        return channels
+
+    async def broadcast_near(self, x, y, message):
+        """Like BaseServer.broadcast, for the clients interested in (x, y)."""
+        metrics = self.server.metrics
+        start = metrics.timer() if metrics is not None else None
+        frame = message + "\n"
+        for channel in self.clients_near(x, y):
+            channel.put(frame)
+        if start is not None:
+            metrics.observe_since("broadcast_seconds", start)
+
+    async def broadcast_data_near(self, x, y, data):
+        """Like BaseServer.broadcast_data, for the clients interested in (x, y)."""
+        metrics = self.server.metrics
+        start = metrics.timer() if metrics is not None else None
+        frames = {}
+        for channel in self.clients_near(x, y):
+            frame = frames.get(channel.codec.name)
+            if frame is None:
+                frame = frames[channel.codec.name] = channel.codec.frame(data)
+            channel.put(frame)
+        if start is not None:
+            metrics.observe_since("broadcast_seconds", start)
@@ -0,0 +1,53 @@
+import time
+
+# Close code for clients that keep exceeding their rate limit.
+CLOSE_POLICY_VIOLATION = 1008
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average, bursting up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self, cost=1):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class ConnectionLimiter:
+    """
+    Rate limits of one connection: a bucket for all its messages and one per
+    command listed in command_limits ({command: (rate, burst)}). strikes
+    counts the messages rejected in a row.
+    """
+
+    def __init__(self, rate=None, burst=None, command_limits=None):
+        self.messages = TokenBucket(rate, burst or rate) if rate else None
+        self.command_limits = command_limits or {}
+        self.commands = {}
+        self.strikes = 0
+
+    def allow_message(self, cost=1):
+        return self._record(self.messages is None or self.messages.allow(cost))
+
+    def allow_command(self, command):
+        limit = self.command_limits.get(command)
+        if limit is None:
+            return True
+        bucket = self.commands.get(command)
+        if bucket is None:
+            bucket = self.commands[command] = TokenBucket(*limit)
+        return self._record(bucket.allow())
+
+    def _record(self, allowed):
+        self.strikes = 0 if allowed else self.strikes + 1
+        return allowed
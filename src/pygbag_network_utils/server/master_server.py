@@ -1,160 +1,904 @@
 import asyncio
-import json
+import secrets
+import signal
+import socket
 import ssl
-import threading
 import websockets
 import random
 import logging
 import argparse
-from . import BaseServer, EchoServer
+import time
+from ..codec import JSON, DecodeError, detect_codec
+from . import EchoServer
+from .cluster import (
+    WORKER_PATH,
+    RemoteRoom,
+    RemoteWorker,
+    WorkerError,
+    spawn_local_workers,
+)
+from .compression import server_extensions
+from .directory import RoomDirectory
+from .fanout import DROP_OLDEST, ClientChannel
+from .hosting import HOSTS, create_host
+from .limits import CLOSE_POLICY_VIOLATION, ConnectionLimiter
+from .metrics import Metrics, render_prometheus, serve_metrics
+from .pool import PoolError, RoomPool
+from .registry import Registry
+
+ROOM_PATH_PREFIX = "/room/"
+# Frames forwarded from a room carry no room id, so a lobby connection is
+# attached to at most one room at a time.
+ATTACHED_ELSEWHERE = "Already attached to another room; leave it first"
+
+
+def request_path(websocket):
+    """Return the HTTP path a websocket connection was opened with."""
+    request = getattr(websocket, "request", None)
+    if request is not None:
+        return request.path
+    return getattr(websocket, "path", "/")
+
+
+def parse_room_path(path):
+    """Return the room id from a "/room/<id>" path, or None for other paths."""
+    if not path or not path.startswith(ROOM_PATH_PREFIX):
+        return None
+    return path[len(ROOM_PATH_PREFIX) :].split("?", 1)[0].strip("/")
+
+
+class LobbyConnection:
+    """A client connected to the lobby, as seen by the command handlers."""
+
+    def __init__(self, websocket, limiter):
+        self.websocket = websocket
+        self.limiter = limiter
+        # Rooms this connection takes part in without a connection of its own.
+        self.attached_rooms = set()
 
 
 class MainServer:
+    # Maps each lobby command to the name of the method handling it. Handlers
+    # are called with the LobbyConnection and the decoded message and return
+    # the reply, or None to send none. Subclasses add commands by extending
+    # this mapping or with register_command().
+    commands = {
+        "list": "command_list",
+        "create": "command_create",
+        "join": "command_join",
+        "leave": "command_leave",
+        "message": "command_message",
+        "nuke": "command_nuke",
+        "subscribe": "command_subscribe",
+        "unsubscribe": "command_unsubscribe",
+    }
+    # Most commands accepted in one {"batch": [...]} frame.
+    max_batch_size = 32
+    # Most rooms returned by one list request.
+    max_list_page_size = 1000
+    # Seconds between room directory updates pushed to subscribers, and how
+    # many updates may queue for a slow subscriber before the oldest go.
+    directory_interval = 0.25
+    subscriber_queue_size = 64
+    # Ingress limits for lobby connections, as on BaseServer. Messages routed
+    # to rooms count against the lobby limits too.
+    max_message_size = 2**16
+    rate_limit = 120
+    rate_limit_burst = 240
+    rate_limit_strikes = 100
+    # Commands that start work on the server get tighter limits.
+    command_rate_limits = {
+        "create": (1, 3),
+        "nuke": (0.2, 1),
+        "list": (10, 20),
+        "join": (20, 40),
+        "subscribe": (1, 5),
+    }
+    # Outgoing compression, as on BaseServer.
+    compression = "deflate"
+    compression_window_bits = 12
+    compression_mem_level = 5
+    compression_threshold = 128
+    compression_context_takeover = True
+    compression_cache_size = 64
+    # Seconds drain() waits for the rooms to empty before closing them, and
+    # for queued frames to be sent afterwards.
+    drain_timeout = 30
+    flush_timeout = 5
+
     def __init__(
         self,
         host="localhost",
         port=8765,
         ssl_context=None,
         game_server_class=EchoServer,
+        hosting="shared",
+        workers=None,
+        worker_token=None,
+        worker_processes=0,
+        warm_rooms=0,
+        room_idle_timeout=300,
+        metrics_port=None,
+        metrics_sample_rate=None,
+        max_rooms=None,
+        reuse_port=False,
+        listen_fd=None,
+        routed_rooms=False,
     ):
         self.host = host
         self.port = port
-        self.echo_servers: dict[int, tuple[BaseServer, threading.Thread]] = {}
+        # Maps server id to the game server and its owner: the RoomPool for
+        # local rooms, the RemoteWorker for rooms on a worker process. Only
+        # the main server's event loop touches it.
+        self.echo_servers = Registry()
         self.next_server_id = 0
-        self.lock = threading.Lock()
+        # Cached listing of echo_servers, and the outbound channels of the
+        # lobby connections subscribed to its changes, by websocket.
+        self.directory = RoomDirectory()
+        self.directory_subscribers = Registry()
+        self.directory_task = None
+        # Most rooms open at once, None for no limit.
+        self.max_rooms = max_rooms
         self.ssl_context = ssl_context
         self.logger = logging.getLogger("MainServer")
+        self.command_handlers = {
+            command: getattr(self, method) for command, method in self.commands.items()
+        }
         self.game_server_class = game_server_class
+        self.game_host = create_host(hosting, workers)
+        # Metrics for the lobby and every local room are collected when a
+        # sample rate is given; metrics_port alone samples 10% of timings.
+        # metrics_port serves them over HTTP on localhost.
+        self.metrics = None
+        self.metrics_port = metrics_port
+        self.metrics_sample_rate = metrics_sample_rate
+        if metrics_port is not None and metrics_sample_rate is None:
+            self.metrics_sample_rate = 0.1
+        if self.metrics_sample_rate is not None:
+            self.metrics = Metrics(self.metrics_sample_rate)
+            self.metrics.gauge("rooms", lambda: len(self.echo_servers))
+            self.metrics.gauge("workers", lambda: len(self.remote_workers))
+            self.metrics.gauge("lobby_connections", lambda: self.lobby_connections)
+            self.metrics.gauge(
+                "clients_in_rooms", lambda: sum(self.get_client_counts().values())
+            )
+        self.lobby_connections = 0
+        self.metrics_server = None
+        # With routed_rooms local rooms bind no port of their own; clients
+        # reach them on this server's port, on /room/<id> or in-band.
+        self.routed_rooms = routed_rooms
+        if routed_rooms and not self.game_host.routable:
+            raise ValueError(
+                f"routed_rooms needs shared hosting, not {self.game_host.name}"
+            )
+        self.pool = RoomPool(
+            self.game_host, self.create_game_server, warm_size=warm_rooms
+        )
+        if routed_rooms:
+            self.pool.port_base = None
+        # Rooms without clients for this many seconds are released back to
+        # the pool or their worker. None keeps empty rooms forever.
+        self.room_idle_timeout = room_idle_timeout
+        self.idle_since = {}
+        self.reaper_task = None
+        # Codec of the last message received on each lobby connection.
+        self.codecs = {}
+        # Worker processes registered on WORKER_PATH. While any are connected,
+        # new rooms go to the least loaded one instead of game_host. Workers
+        # are only accepted with a token; one is generated for the
+        # worker_processes started by the lobby itself.
+        self.remote_workers = Registry()
+        self.next_worker_id = 0
+        self.worker_processes = worker_processes
+        self.worker_token = worker_token
+        if worker_processes and worker_token is None:
+            self.worker_token = secrets.token_urlsafe(16)
+        self.processes = []
+        # With reuse_port a replacement lobby can listen on the same port
+        # while this one drains. listen_fd adopts a listening socket handed
+        # down by the process being replaced (or a supervisor) instead of
+        # binding one.
+        self.reuse_port = reuse_port
+        self.listen_fd = listen_fd
+        self.server = None
+        self.draining = False
+        self.drain_task = None
 
     async def handle_client(self, websocket):
+        path = request_path(websocket)
+        if path.split("?", 1)[0] == WORKER_PATH:
+            await self.handle_worker_connection(websocket)
+            return
+        room_id = parse_room_path(path)
+        if room_id is not None:
+            await self.handle_room_connection(websocket, room_id)
+            return
+
+        connection = LobbyConnection(
+            websocket,
+            ConnectionLimiter(
+                self.rate_limit, self.rate_limit_burst, self.command_rate_limits
+            ),
+        )
+        self.lobby_connections += 1
         try:
-            while True:
-                try:
-                    message = await websocket.recv()
-                    self.logger.debug(f"Received message: {message}")
-                    data = json.loads(message)
-                    command = data.get("command")
-
-                    if command == "list":
-                        await self.list_echo_servers(websocket)
-                    elif command == "create":
-                        address, server_id = await self.create_echo_server()
-                        await websocket.send(
-                            json.dumps(
-                                {
-                                    "message": f"Created Echo Server",
-                                    "address": address,
-                                    "server_id": server_id,
-                                }
-                            )
-                            + "\n"
-                        )
-                    elif command == "join":
-                        await self.join_echo_server(websocket, data.get("server_id"))
-                    elif command == "message":
-                        self.logger.info(f"Received message: {data.get('message')}")
-                        await websocket.send(
-                            json.dumps({"message": "Message received"}) + "\n"
-                        )
-                    elif command == "nuke":
-                        self.logger.info(f"Nuking server")
-                        await websocket.send(
-                            json.dumps({"message": "Nuking server"}) + "\n"
-                        )
-                        for server_id, server_data in self.echo_servers.items():
-                            server, thread = server_data
-                            # server.broadcast()
-                            server.running = False
-                            # thread.join()
-                            self.logger.info(f"Stopped server {server_id}")
-                        self.echo_servers.clear()
-                        await websocket.send(
-                            json.dumps({"message": "All servers nuked"}) + "\n"
-                        )
-                        self.logger.info(f"All servers nuked")
-                    else:
-                        await websocket.send(
-                            json.dumps({"error": "Invalid command"}) + "\n"
-                        )
-                except json.JSONDecodeError as e:
-                    self.logger.error(f"JSONDecodeError: {e}")
-                    await websocket.send(
-                        json.dumps({"error": "Invalid JSON format"}) + "\n"
-                    )
-                except KeyError as e:
-                    self.logger.error(f"KeyError: {e}")
-                    await websocket.send(
-                        json.dumps({"error": f"Missing key: {e}"}) + "\n"
-                    )
-                except Exception as e:
-                    self.logger.exception(
-                        f"Unexpected error processing command from {websocket.remote_address}|{e}|"
-                    )
+            async for message in websocket:
+                if not await self.handle_lobby_message(connection, message):
                     break
-
+        except websockets.exceptions.ConnectionClosedOK:
+            # Closed while a reply was being sent.
+            pass
         except websockets.exceptions.ConnectionClosedError:
             self.logger.info(f"Client disconnected from main server")
         except Exception as e:
-            self.logger.exception(f"Error handling client: {e}")
-
-    async def list_echo_servers(self, websocket):
-        server_list = []
-        with self.lock:
-            for id, server_data in self.echo_servers.items():
-                server, _ = server_data
-                server_list.append(
-                    {
-                        "id": id,
-                        "address": f"ws://{self.host}:{server.port}",
-                        "clients": server.get_client_count(),
-                    }
-                )  # Include client count
-        await websocket.send(json.dumps({"servers": server_list}) + "\n")
+            self.logger.exception(
+                f"Unexpected error processing command from {websocket.remote_address}|{e}|"
+            )
+        finally:
+            self.lobby_connections -= 1
+            self.unsubscribe(websocket)
+            self.codecs.pop(websocket, None)
+            for server in connection.attached_rooms:
+                server.remove_client(websocket)
 
-    async def create_echo_server(self):
-        echo_port = self.next_server_id + 9000
-        # echo_port = random.randint(9000, 9999)
-        echo_server = self.game_server_class(self.host, echo_port, self.ssl_context)
-        thread = threading.Thread(target=asyncio.run, args=(echo_server.start(),))
-        thread.daemon = (
-            True  # Allow main program to exit even if thread is still running
+    def register_command(self, command, handler):
+        """Handle command with handler(connection, data) on this lobby."""
+        self.command_handlers[command] = handler
+
+    async def handle_lobby_message(self, connection, message):
+        """
+        Handle one frame from a lobby connection: a command, a batch of
+        commands or a message for a room. Returns False once the connection
+        has been closed.
+        """
+        websocket = connection.websocket
+        limiter = connection.limiter
+        if not limiter.allow_message():
+            return not await self.reject_message(websocket, limiter)
+        # Lazy %-formatting: this runs for every lobby message.
+        self.logger.debug("Received message: %s", message)
+        if self.metrics is not None:
+            self.metrics.record_in(len(message))
+        try:
+            codec = detect_codec(message)
+            self.codecs[websocket] = codec
+            data = codec.decode(message)
+        except DecodeError as e:
+            self.logger.error(f"DecodeError: {e}")
+            await self.send(websocket, {"error": f"Invalid {e.codec.upper()} format"})
+            return True
+        if not isinstance(data, dict):
+            await self.send(websocket, {"error": "Invalid message"})
+            return True
+
+        if "batch" in data:
+            return await self.run_batch(connection, data["batch"])
+        if "room" in data and "command" not in data:
+            start = self.metrics.timer() if self.metrics is not None else None
+            await self.route_message(
+                websocket, data["room"], message, connection.attached_rooms
+            )
+            if start is not None:
+                self.metrics.observe_since("handler_seconds", start, handler="room")
+            return True
+
+        command = data.get("command")
+        # Anything but a string is answered as an invalid command below.
+        if isinstance(command, str) and not limiter.allow_command(command):
+            return not await self.reject_message(websocket, limiter)
+        reply = await self.run_command(connection, data)
+        if reply is not None:
+            await self.send(websocket, reply)
+        return True
+
+    async def run_batch(self, connection, batch):
+        """
+        Run the commands of a {"batch": [...]} frame in order and send all
+        their replies back in one {"batch": [...]} frame. Every command counts
+        against the rate limits on its own.
+        """
+        websocket = connection.websocket
+        limiter = connection.limiter
+        if not isinstance(batch, list):
+            await self.send(websocket, {"error": "Invalid batch"})
+            return True
+        if len(batch) > self.max_batch_size:
+            await self.send(
+                websocket, {"error": f"Batch exceeds {self.max_batch_size} commands"}
+            )
+            return True
+        # The frame itself was already counted.
+        if len(batch) > 1 and not limiter.allow_message(len(batch) - 1):
+            return not await self.reject_message(websocket, limiter)
+
+        replies = []
+        for data in batch:
+            if not isinstance(data, dict) or "command" not in data:
+                reply = {"error": "Invalid command"}
+                if isinstance(data, dict) and "id" in data:
+                    reply["id"] = data["id"]
+                replies.append(reply)
+                continue
+            command = data["command"]
+            if isinstance(command, str) and not limiter.allow_command(command):
+                if await self.reject_message(websocket, limiter, notify=False):
+                    return False
+                reply = {"id": data["id"]} if "id" in data else {}
+                reply["error"] = "Rate limit exceeded"
+                replies.append(reply)
+                continue
+            reply = await self.run_command(connection, data)
+            if reply is not None:
+                replies.append(reply)
+        await self.send(websocket, {"batch": replies})
+        return True
+
+    async def run_command(self, connection, data):
+        """
+        Run one command and return its reply, carrying the request's "id" if
+        it had one so clients can match replies to pipelined requests.
+        """
+        command = data.get("command")
+        handler = None
+        if isinstance(command, str):
+            handler = self.command_handlers.get(command)
+        start = self.metrics.timer() if self.metrics is not None else None
+        if handler is None:
+            reply = {"error": "Invalid command"}
+        else:
+            try:
+                reply = await handler(connection, data)
+            except KeyError as e:
+                self.logger.error(f"KeyError: {e}")
+                reply = {"error": f"Missing key: {e}"}
+        if start is not None:
+            # Only registered commands get their own series, so clients
+            # cannot create new ones.
+            self.metrics.observe_since(
+                "handler_seconds",
+                start,
+                handler=command if handler is not None else "other",
+            )
+        if reply is not None and "id" in data:
+            reply = {"id": data["id"], **reply}
+        return reply
+
+    async def command_list(self, connection, data):
+        since = data.get("since")
+        if since is not None:
+            changes = None
+            if isinstance(since, int):
+                changes = self.directory.changes_since(since)
+            if changes is not None:
+                return {"version": self.directory.version, "changes": changes}
+        return self.list_reply(data)
+
+    async def command_subscribe(self, connection, data):
+        reply = self.list_reply(data)
+        if "error" in reply:
+            return reply
+        websocket = connection.websocket
+        if websocket not in self.directory_subscribers:
+            self.directory_subscribers.add(
+                websocket,
+                ClientChannel(
+                    websocket, self.subscriber_queue_size, DROP_OLDEST, self.metrics
+                ),
+            )
+        reply["subscribed"] = True
+        return reply
+
+    async def command_unsubscribe(self, connection, data):
+        self.unsubscribe(connection.websocket)
+        return {"subscribed": False}
+
+    async def command_create(self, connection, data):
+        try:
+            if self.draining:
+                raise PoolError("Server is shutting down")
+            address, server_id = await self.create_echo_server()
+        except (PoolError, WorkerError) as e:
+            self.logger.error(f"Could not create a room: {e}")
+            return {"error": str(e)}
+        return {
+            "message": f"Created Echo Server",
+            "address": address,
+            "server_id": server_id,
+        }
+
+    async def command_join(self, connection, data):
+        return self.join_echo_server(
+            connection.websocket,
+            data.get("server_id"),
+            connection.attached_rooms if data.get("attach") else None,
+        )
+
+    async def command_leave(self, connection, data):
+        server = self.get_room(data.get("server_id"))
+        if server in connection.attached_rooms:
+            connection.attached_rooms.discard(server)
+            server.remove_client(connection.websocket)
+        return {"message": "Left Echo Server"}
+
+    async def command_message(self, connection, data):
+        self.logger.info("Received message: %s", data.get("message"))
+        return {"message": "Message received"}
+
+    async def command_nuke(self, connection, data):
+        self.logger.info(f"Nuking server")
+        await self.send(connection.websocket, {"message": "Nuking server"})
+        for server_id in self.echo_servers.keys():
+            self.release_room(server_id)
+            self.logger.info(f"Stopped server {server_id}")
+        self.logger.info(f"All servers nuked")
+        return {"message": "All servers nuked"}
+
+    async def send(self, websocket, data):
+        """Send data to a lobby client in the codec it last used."""
+        frame = self.codecs.get(websocket, JSON).frame(data)
+        await websocket.send(frame)
+        if self.metrics is not None:
+            self.metrics.record_out(len(frame))
+
+    async def reject_message(self, websocket, limiter, notify=True):
+        """
+        Handle a lobby message that went over a rate limit, like
+        BaseServer.reject_message. Returns True if the client was disconnected.
+        Batches report rejected commands in their reply, so they pass
+        notify=False.
+        """
+        if self.metrics is not None:
+            self.metrics.inc("rate_limited")
+        if notify and limiter.strikes == 1:
+            await self.send(websocket, {"error": "Rate limit exceeded"})
+        if limiter.strikes < self.rate_limit_strikes:
+            return False
+        self.logger.warning(
+            f"Disconnecting {websocket.remote_address}: rate limit exceeded"
+        )
+        await websocket.close(CLOSE_POLICY_VIOLATION, "Rate limit exceeded")
+        return True
+
+    def create_game_server(self, port):
+        server = self.game_server_class(self.host, port, self.ssl_context)
+        if self.metrics is not None:
+            server.enable_metrics(self.metrics_sample_rate)
+        return server
+
+    def get_metrics(self):
+        """
+        Return snapshots of the lobby metrics and of every local room, or
+        None if metrics are not enabled.
+        """
+        if self.metrics is None:
+            return None
+        rooms = {}
+        for server_id, (server, _) in self.echo_servers.items():
+            if not isinstance(server, RemoteRoom):
+                rooms[server_id] = server.get_metrics()
+        return {"lobby": self.metrics.snapshot(), "rooms": rooms}
+
+    def render_metrics(self):
+        """Return the lobby and room metrics in the Prometheus text format."""
+        sources = [({"server": "lobby"}, self.metrics)]
+        for server_id, (server, _) in self.echo_servers.items():
+            if getattr(server, "metrics", None) is not None:
+                sources.append(({"server": "room", "room": server_id}, server.metrics))
+        return render_prometheus(sources)
+
+    def get_room(self, server_id):
+        try:
+            server_id = int(server_id)
+        except (TypeError, ValueError):
+            return None
+        server_data = self.echo_servers.get(server_id)
+        return server_data[0] if server_data else None
+
+    def get_client_counts(self):
+        """Return the number of clients in each room, by server id."""
+        return {
+            server_id: server.get_client_count()
+            for server_id, (server, _) in self.echo_servers.items()
+        }
+
+    def is_routable(self, server):
+        """Rooms can only use lobby connections when they share its event loop."""
+        return (
+            server.running
+            and not isinstance(server, RemoteRoom)
+            and getattr(self.game_host, "routable", False)
+        )
+
+    def release_room(self, server_id):
+        """Remove a room and hand its server back to the pool or worker."""
+        server, owner = self.echo_servers.pop(server_id, (None, None))
+        self.idle_since.pop(server_id, None)
+        self.directory.remove(server_id)
+        if server is not None:
+            if not isinstance(server, RemoteRoom):
+                server.on_clients_changed = None
+            owner.release(server)
+
+    async def reap_idle_rooms(self):
+        """Release rooms that have been empty for room_idle_timeout seconds."""
+        interval = min(self.room_idle_timeout / 2, 5)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for server_id, (server, _) in self.echo_servers.items():
+                if server.get_client_count():
+                    self.idle_since.pop(server_id, None)
+                    continue
+                since = self.idle_since.setdefault(server_id, now)
+                if now - since >= self.room_idle_timeout:
+                    self.logger.info(f"Reaping idle room {server_id}")
+                    self.release_room(server_id)
+
+    async def handle_room_connection(self, websocket, room_id):
+        """Serve a connection opened on "/room/<id>" as a client of that room."""
+        server = self.get_room(room_id)
+        if server is None:
+            await self.send(websocket, {"error": "Server not found"})
+            return
+        if not self.is_routable(server):
+            await self.send(
+                websocket,
+                {
+                    "error": "Room is not routable on this connection",
+                    "address": self.room_address(room_id, server),
+                },
+            )
+            return
+        await server.handle_client(websocket)
+
+    async def route_message(self, websocket, server_id, message, attached_rooms):
+        """
+        Deliver a message carrying a "room" field to that room. The connection
+        joins the room on its first routed message so it also receives the
+        room's broadcasts.
+        """
+        server = self.get_room(server_id)
+        if server is None:
+            await self.send(websocket, {"error": "Server not found"})
+            return
+        if not self.is_routable(server):
+            await self.send(
+                websocket, {"error": "Room is not routable on this connection"}
+            )
+            return
+        if server not in attached_rooms:
+            if attached_rooms:
+                await self.send(websocket, {"error": ATTACHED_ELSEWHERE})
+                return
+            attached_rooms.add(server)
+            server.add_client(websocket)
+        if not server.allow_message(websocket):
+            await server.reject_message(websocket)
+            return
+        await server.dispatch_message(websocket, message)
+
+    def list_echo_servers(self):
+        return [dict(room) for room in self.directory.rooms()]
+
+    def list_reply(self, data):
+        """
+        Return one page of the room directory for a list or subscribe
+        request, with the directory version it reflects and the number of
+        matching rooms.
+        """
+        options = {}
+        for key in ("offset", "limit", "min_clients", "max_clients"):
+            value = data.get(key)
+            if value is None:
+                continue
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                return {"error": f"Invalid {key}"}
+            options[key] = value
+        options["limit"] = min(
+            options.get("limit", self.max_list_page_size), self.max_list_page_size
         )
-        thread.start()
-        with self.lock:
-            self.echo_servers[self.next_server_id] = (echo_server, thread)
-            server_id = self.next_server_id
-            self.next_server_id += 1
-        return f"ws://{self.host}:{echo_port}", server_id
-
-    async def join_echo_server(self, websocket, server_id):
-        with self.lock:
-            if server_id in self.echo_servers:
-                server, _ = self.echo_servers[server_id]
-                address = f"ws://{self.host}:{server.port}"
-                await websocket.send(
-                    json.dumps(
-                        {
-                            "message": f"Joined Echo Server {server_id}",
-                            "address": address,
-                            "host": self.host,
-                            "port": server.port,
-                            "server_id": server_id,
-                        }
-                    )
-                    + "\n"
+        servers, total = self.directory.listing(**options)
+        return {
+            "servers": servers,
+            "total": total,
+            "version": self.directory.version,
+        }
+
+    def unsubscribe(self, websocket):
+        channel = self.directory_subscribers.pop(websocket)
+        if channel is not None:
+            channel.close()
+
+    async def publish_directory(self):
+        """
+        Every directory_interval, apply the client counts rooms reported and
+        push the directory's changes to its subscribers. Each update is
+        encoded once per codec, however many subscribers there are.
+        """
+        while True:
+            await asyncio.sleep(self.directory_interval)
+            changes = self.directory.flush()
+            if not changes or not len(self.directory_subscribers):
+                continue
+            update = {
+                "directory": {"version": self.directory.version, "changes": changes}
+            }
+            frames = {}
+            for websocket, channel in self.directory_subscribers.items():
+                codec = self.codecs.get(websocket, JSON)
+                frame = frames.get(codec)
+                if frame is None:
+                    frame = frames[codec] = codec.frame(update)
+                channel.put(frame)
+
+    def watch_room(self, server_id, server):
+        """Keep the directory's client count of a local room current."""
+        loop = asyncio.get_running_loop()
+
+        def clients_changed(server):
+            # Runs on the room's loop, which may be another thread.
+            try:
+                loop.call_soon_threadsafe(
+                    self.directory.set_clients, server_id, server.get_client_count()
                 )
-            else:
-                await websocket.send(json.dumps({"error": "Server not found"}) + "\n")
+            except RuntimeError:
+                pass  # The lobby's loop is already closed.
+
+        server.on_clients_changed = clients_changed
+
+    def pick_worker(self):
+        """
+        Return the least loaded worker with room to spare. Raises WorkerError
+        if workers are connected but all of them are full, and returns None
+        without workers.
+        """
+        if not len(self.remote_workers):
+            return None
+        available = [
+            worker for worker in self.remote_workers.values() if worker.has_capacity()
+        ]
+        if not available:
+            raise WorkerError("All workers are full")
+        return min(available, key=lambda worker: worker.load)
+
+    async def create_echo_server(self):
+        if self.max_rooms is not None and len(self.echo_servers) >= self.max_rooms:
+            raise PoolError("Room limit reached")
+        worker = self.pick_worker()
+        server_id = self.next_server_id
+        self.next_server_id += 1
+        if worker is not None:
+            room = await worker.create_room(server_id)
+            self.echo_servers.add(server_id, (room, worker))
+            self.directory.add(server_id, f"ws://{room.host}:{room.port}")
+            self.logger.info(
+                f"Placed room {server_id} on worker {worker.worker_id} "
+                f"({worker.room_count} rooms, {worker.clients} clients)"
+            )
+            return f"ws://{room.host}:{room.port}", server_id
+
+        echo_server = await self.pool.acquire()
+        address = self.room_address(server_id, echo_server)
+        self.echo_servers.add(server_id, (echo_server, self.pool))
+        self.directory.add(server_id, address, echo_server.get_client_count())
+        self.watch_room(server_id, echo_server)
+        return address, server_id
+
+    def room_address(self, server_id, server):
+        """
+        Address clients connect to for a room: its own port, or the /room/<id>
+        path on this server for rooms without a listener.
+        """
+        if server.port is None:
+            return f"ws://{self.host}:{self.port}{ROOM_PATH_PREFIX}{server_id}"
+        return f"ws://{server.host}:{server.port}"
+
+    def join_echo_server(self, websocket, server_id, attached_rooms=None):
+        """
+        Return the reply to a join: the address of a room. When attached_rooms
+        is given the connection also joins the room in place, so the client
+        can keep talking to it by tagging messages with "room": server_id.
+        """
+        server = self.get_room(server_id)
+        if server is None:
+            return {"error": "Server not found"}
+        routed_only = server.port is None
+        response = {
+            "message": f"Joined Echo Server {server_id}",
+            "address": self.room_address(server_id, server),
+            "host": self.host if routed_only else server.host,
+            "port": self.port if routed_only else server.port,
+            "path": f"{ROOM_PATH_PREFIX}{server_id}",
+            "server_id": server_id,
+        }
+        if attached_rooms is not None:
+            if attached_rooms and server not in attached_rooms:
+                return {"error": ATTACHED_ELSEWHERE}
+            attached = self.is_routable(server)
+            if attached and server not in attached_rooms:
+                attached_rooms.add(server)
+                server.add_client(websocket)
+            response["attached"] = attached
+        return response
+
+    async def handle_worker_connection(self, websocket):
+        """Serve a worker process that registers on WORKER_PATH."""
+        try:
+            data = JSON.decode(await websocket.recv())
+        except (DecodeError, websockets.exceptions.ConnectionClosed):
+            return
+        if not isinstance(data, dict):
+            data = {}  # Refused below like any other bad registration.
+        token = data.get("token")
+        if (
+            data.get("command") != "register"
+            or self.worker_token is None
+            or not isinstance(token, str)
+            or not secrets.compare_digest(token, self.worker_token)
+        ):
+            self.logger.warning(
+                f"Rejected worker registration from {websocket.remote_address}"
+            )
+            await websocket.send(JSON.frame({"error": "Registration refused"}))
+            return
+
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        worker = RemoteWorker(
+            worker_id,
+            websocket,
+            data.get("host") or websocket.remote_address[0],
+            data.get("max_rooms"),
+            self.directory.set_clients,
+        )
+        self.remote_workers.add(worker_id, worker)
+        self.logger.info(f"Worker {worker_id} registered from {worker.host}")
+        try:
+            await worker.send({"registered": worker_id})
+            async for message in websocket:
+                try:
+                    worker.handle_message(JSON.decode(message))
+                except (DecodeError, KeyError) as e:
+                    self.logger.error(f"Invalid message from worker {worker_id}: {e}")
+        except websockets.exceptions.ConnectionClosedError:
+            pass
+        finally:
+            self.remote_workers.discard(worker_id)
+            worker.close()
+            for server_id, (server, _) in self.echo_servers.items():
+                if isinstance(server, RemoteRoom) and server.worker is worker:
+                    server.running = False
+                    self.echo_servers.discard(server_id)
+                    self.idle_since.pop(server_id, None)
+                    self.directory.remove(server_id)
+            self.logger.info(f"Worker {worker_id} disconnected")
+
+    async def drain(self, timeout=None):
+        """
+        Shut down without cutting players off. The listener closes first, so
+        a replacement lobby sharing the port takes all new connections, and
+        no new rooms are created. Rooms are released as they empty; after
+        timeout seconds (drain_timeout by default) the remaining rooms, local
+        or on workers, are drained, and everything still connected is flushed
+        and closed with 1001 (going away). start() returns once all of it is
+        closed.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        if timeout is None:
+            timeout = self.drain_timeout
+        self.logger.info(f"Draining main server ({timeout}s)")
+        # Released rooms are stopped instead of kept warm.
+        self.pool.warm_size = 0
+        if self.server is not None:
+            self.server.close(close_connections=False)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            for server_id, (server, _) in self.echo_servers.items():
+                if not server.get_client_count():
+                    self.release_room(server_id)
+            if not self.echo_servers or loop.time() >= deadline:
+                break
+            await asyncio.sleep(0.5)
+        drains = []
+        remote_rooms = {}
+        for server_id, (server, _) in self.echo_servers.items():
+            if isinstance(server, RemoteRoom):
+                remote_rooms.setdefault(server.worker, []).append(server_id)
+                continue
+            future = server.request_drain(0)
+            if future is not None:
+                drains.append(asyncio.wrap_future(future))
+        for worker, server_ids in remote_rooms.items():
+            drains.append(worker.drain_rooms(server_ids, 2 * self.flush_timeout))
+        await asyncio.gather(*drains, return_exceptions=True)
+        for server_id in self.echo_servers.keys():
+            self.release_room(server_id)
+        # Warm rooms were never handed out; stop them too and wait until
+        # every local room has shut down and let go of its port.
+        await self.pool.close(self.flush_timeout)
+        subscribers = [
+            channel.drain() for channel in self.directory_subscribers.values()
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*subscribers), self.flush_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning("Gave up flushing directory updates")
+        if self.server is not None:
+            # The listener is already closed, so close() would not do this.
+            await asyncio.gather(
+                *(
+                    websocket.close(1001, "Server shutting down")
+                    for websocket in self.server.connections
+                ),
+                return_exceptions=True,
+            )
+        self.logger.info("Drained main server")
+
+    def request_drain(self):
+        """Start drain() in the background, e.g. from a signal handler."""
+        if self.drain_task is None:
+            self.drain_task = asyncio.get_running_loop().create_task(self.drain())
 
     async def start(self):
+        if self.listen_fd is not None:
+            listen = {"sock": socket.socket(fileno=self.listen_fd)}
+        else:
+            listen = {"host": self.host, "port": self.port}
+            if self.reuse_port:
+                listen["reuse_port"] = True
         try:
-            server = await websockets.serve(
-                self.handle_client, self.host, self.port, ssl=self.ssl_context
+            self.server = await websockets.serve(
+                self.handle_client,
+                ssl=self.ssl_context,
+                max_size=self.max_message_size,
+                compression=None,
+                extensions=server_extensions(self),
+                **listen,
             )
-            self.logger.info(f"Main server started on ws://{self.host}:{self.port}")
-            await server.wait_closed()
+            self.logger.info(
+                f"Main server started on ws://{self.host}:{self.port} "
+                f"({self.game_host.name} hosting)"
+            )
+            if self.worker_processes:
+                self.processes = await spawn_local_workers(
+                    self.worker_processes,
+                    f"ws://{self.host}:{self.port}{WORKER_PATH}",
+                    self.worker_token,
+                    self.game_server_class,
+                    self.host,
+                    warm_rooms=self.pool.warm_size,
+                )
+                self.logger.info(f"Started {len(self.processes)} worker processes")
+            if self.metrics_port is not None:
+                self.metrics_server = await serve_metrics(
+                    self.render_metrics, self.get_metrics, port=self.metrics_port
+                )
+            self.pool.fill()
+            # A new room would be reaped before anyone could join it, so 0
+            # turns reaping off like None.
+            if self.room_idle_timeout:
+                self.reaper_task = asyncio.create_task(self.reap_idle_rooms())
+            self.directory_task = asyncio.create_task(self.publish_directory())
+            await self.server.wait_closed()
         except Exception as e:
             self.logger.error(f"Error starting main server: {e}")
+        finally:
+            if self.reaper_task is not None:
+                self.reaper_task.cancel()
+            if self.directory_task is not None:
+                self.directory_task.cancel()
+            for websocket in self.directory_subscribers.keys():
+                self.unsubscribe(websocket)
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+            for process in self.processes:
+                if process.returncode is None:
+                    process.terminate()
+            await self.pool.close(self.flush_timeout)
+            self.game_host.shutdown()
 
 
 def main():
@@ -171,6 +915,82 @@ def main():
     parser.add_argument(
         "--port", type=int, default=8765, help="Port for the main server"
     )
+    parser.add_argument(
+        "--hosting",
+        choices=sorted(HOSTS),
+        default="shared",
+        help="How game servers are run: on the main loop, a loop pool or a thread each",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of loops for pool hosting (defaults to the CPU count)",
+    )
+    parser.add_argument(
+        "--worker-processes",
+        type=int,
+        default=0,
+        help="Number of local worker processes to host rooms in",
+    )
+    parser.add_argument(
+        "--worker-token",
+        type=str,
+        default=None,
+        help="Token external workers register with (none accepted without one)",
+    )
+    parser.add_argument(
+        "--warm-rooms",
+        type=int,
+        default=0,
+        help="Number of idle rooms kept started, ready to hand out",
+    )
+    parser.add_argument(
+        "--room-idle-timeout",
+        type=float,
+        default=300,
+        help="Seconds an empty room is kept before it is recycled (0 keeps it)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on this localhost port",
+    )
+    parser.add_argument(
+        "--metrics-sample-rate",
+        type=float,
+        default=None,
+        help="Fraction of handler calls and broadcasts to time (enables metrics)",
+    )
+    parser.add_argument(
+        "--max-rooms",
+        type=int,
+        default=None,
+        help="Most rooms open at once (no limit by default)",
+    )
+    parser.add_argument(
+        "--routed-rooms",
+        action="store_true",
+        help="Serve rooms only through the main server's port (shared hosting)",
+    )
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="Listen with SO_REUSEPORT so a replacement can start before this one drains",
+    )
+    parser.add_argument(
+        "--listen-fd",
+        type=int,
+        default=None,
+        help="Accept on this inherited listening socket instead of binding --port",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=MainServer.drain_timeout,
+        help="Seconds to wait for rooms to empty on SIGTERM before closing them",
+    )
     parser.add_argument("--cert", type=int, default=None, help="Path to Cert file")
     parser.add_argument("--key", type=int, default=None, help="Path to Key file")
 
@@ -187,8 +1007,36 @@ def main():
             logging.info("example will run withou ssl context")
             ssl_context = None
 
-    main_server = MainServer(host=args.host, port=args.port, ssl_context=ssl_context)
-    asyncio.run(main_server.start())
+    main_server = MainServer(
+        host=args.host,
+        port=args.port,
+        ssl_context=ssl_context,
+        hosting=args.hosting,
+        workers=args.workers,
+        worker_token=args.worker_token,
+        worker_processes=args.worker_processes,
+        warm_rooms=args.warm_rooms,
+        room_idle_timeout=args.room_idle_timeout,
+        metrics_port=args.metrics_port,
+        metrics_sample_rate=args.metrics_sample_rate,
+        max_rooms=args.max_rooms,
+        reuse_port=args.reuse_port,
+        listen_fd=args.listen_fd,
+        routed_rooms=args.routed_rooms,
+    )
+    main_server.drain_timeout = args.drain_timeout
+
+    async def run():
+        # SIGTERM drains instead of dropping every player mid-game.
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, main_server.request_drain
+            )
+        except NotImplementedError:
+            pass  # No signal handlers on Windows event loops.
+        await main_server.start()
+
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+import asyncio
+import bisect
+import json
+import logging
+import time
+
+
+class Histogram:
+    """Prometheus-style histogram of durations in seconds."""
+
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return (upper bound, observations <= bound) pairs, ending with +Inf."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.BUCKETS + (float("inf"),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                format_bound(bound): count for bound, count in self.cumulative()
+            },
+        }
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms of one server.
+
+    Counters are plain integer additions. Gauges are callbacks read only when
+    a snapshot is taken. Timings are sampled: timer() starts a measurement for
+    one call in every 1 / sample_rate and returns None otherwise, so the clock
+    is not even read for the rest. Histogram counts are therefore counts of
+    sampled calls; the counters hold the exact totals.
+    """
+
+    def __init__(self, sample_rate=0.1):
+        self.sample_every = round(1 / sample_rate) if sample_rate else 0
+        self._countdown = 1
+        self.counters = {}
+        self.gauges = {}
+        # Maps (name, ((label, value), ...)) to a Histogram.
+        self.histograms = {}
+
+    def inc(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_in(self, size):
+        self.inc("messages_in")
+        self.inc("bytes_in", size)
+
+    def record_out(self, size, messages=1):
+        self.inc("messages_out", messages)
+        self.inc("bytes_out", size * messages)
+
+    def gauge(self, name, callback):
+        self.gauges[name] = callback
+
+    def timer(self):
+        """Return a start time for the sampled calls, None for the others."""
+        if not self.sample_every:
+            return None
+        self._countdown -= 1
+        if self._countdown:
+            return None
+        self._countdown = self.sample_every
+        return time.perf_counter()
+
+    def observe_since(self, name, start, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        histograms = {}
+        # list() copies in one step, so a snapshot taken from another thread
+        # does not trip over metrics being added meanwhile.
+        for (name, labels), histogram in list(self.histograms.items()):
+            label = ",".join(f"{key}={value}" for key, value in labels)
+            histograms.setdefault(name, {})[label] = histogram.snapshot()
+        return {
+            "counters": dict(list(self.counters.items())),
+            "gauges": {
+                name: callback() for name, callback in list(self.gauges.items())
+            },
+            "histograms": histograms,
+        }
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render_prometheus(sources, prefix="pygbag"):
+    """
+    Render metrics in the Prometheus text format. sources is a list of
+    (labels, Metrics) pairs; the labels tell the servers apart.
+    """
+    families = {}
+
+    def add(name, kind, labels, value):
+        families.setdefault(name, (kind, []))[1].append(
+            f"{name}{format_labels(labels)} {value}"
+        )
+
+    for labels, metrics in sources:
+        for name, value in list(metrics.counters.items()):
+            add(f"{prefix}_{name}_total", "counter", labels, value)
+        for name, callback in list(metrics.gauges.items()):
+            add(f"{prefix}_{name}", "gauge", labels, callback())
+        for (name, histogram_labels), histogram in list(metrics.histograms.items()):
+            full_name = f"{prefix}_{name}"
+            series = dict(labels, **dict(histogram_labels))
+            for bound, count in histogram.cumulative():
+                add(
+                    f"{full_name}_bucket",
+                    "histogram",
+                    dict(series, le=format_bound(bound)),
+                    count,
+                )
+            add(f"{full_name}_sum", "histogram", series, histogram.sum)
+            add(f"{full_name}_count", "histogram", series, histogram.count)
+
+    lines = []
+    declared = set()
+    for name, (kind, samples) in families.items():
+        family = name
+        if kind == "histogram":
+            family = name.rsplit("_", 1)[0]
+        if family not in declared:
+            declared.add(family)
+            lines.append(f"# TYPE {family} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+async def serve_metrics(render, snapshot, host="127.0.0.1", port=9100):
+    """
+    Serve GET /metrics (Prometheus text from render()) and GET /metrics.json
+    (snapshot() as JSON) over plain HTTP. Binds to localhost by default; the
+    metrics are not meant for the public game port.
+    """
+    logger = logging.getLogger("metrics")
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) > 1 else "/"
+            if path == "/metrics":
+                status = "200 OK"
+                content_type = "text/plain; version=0.0.4"
+                body = render().encode("utf-8")
+            elif path == "/metrics.json":
+                status = "200 OK"
+                content_type = "application/json"
+                body = json.dumps(snapshot()).encode("utf-8")
+            else:
+                status = "404 Not Found"
+                content_type = "text/plain"
+                body = b"Not found\n"
+            writer.write(
+                (
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("ascii")
+                + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    return server
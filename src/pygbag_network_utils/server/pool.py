@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import logging
+
+
+class PoolError(Exception):
+    pass
+
+
+class RoomPool:
+    """
+    Hands out game servers that are already listening.
+
+    Servers are started through a host (see hosting.py) and only handed out
+    once they accept connections, so clients never race the bind. Up to
+    warm_size idle servers are kept started in the background, making
+    acquire() instant while the pool is warm. Released servers are recycled
+    into the pool while it is below warm_size and stopped otherwise; their
+    ports are reused once they have shut down. With port_base None servers
+    are started without a port (and listener) of their own.
+    """
+
+    def __init__(
+        self,
+        game_host,
+        factory,
+        port_base=9000,
+        warm_size=0,
+        ready_timeout=10.0,
+        max_attempts=10,
+    ):
+        self.game_host = game_host
+        # Called with a port, returns a new (not yet started) game server.
+        self.factory = factory
+        self.port_base = port_base
+        self.warm_size = warm_size
+        self.ready_timeout = ready_timeout
+        self.max_attempts = max_attempts
+        self.idle = collections.deque()
+        self.warming = 0
+        self.ports_in_use = set()
+        # Every server started and not yet shut down, idle or handed out.
+        self.servers = set()
+        # Ports some other process was already listening on.
+        self.unavailable_ports = set()
+        self.tasks = set()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def allocate_port(self):
+        if self.port_base is None:
+            return None
+        port = self.port_base
+        while port in self.ports_in_use or port in self.unavailable_ports:
+            port += 1
+        self.ports_in_use.add(port)
+        return port
+
+    def free_port(self, port):
+        self.ports_in_use.discard(port)
+
+    def _forget(self, server, port):
+        self.servers.discard(server)
+        self.free_port(port)
+
+    def _server_finished(self, loop, server, port):
+        # Runs on whichever thread the server ran on.
+        try:
+            loop.call_soon_threadsafe(self._forget, server, port)
+        except RuntimeError:
+            pass  # The pool's loop is already closed.
+
+    async def start_server(self):
+        """Start a new server and wait until it is listening."""
+        loop = asyncio.get_running_loop()
+        for _ in range(self.max_attempts):
+            port = self.allocate_port()
+            server = self.factory(port)
+            self.servers.add(server)
+            server.finished.add_done_callback(
+                lambda _, server=server, port=port: self._server_finished(
+                    loop, server, port
+                )
+            )
+            self.game_host.spawn(server)
+            try:
+                await server.wait_ready(self.ready_timeout)
+                return server
+            except asyncio.TimeoutError:
+                self.game_host.stop(server)
+                raise PoolError(f"Server on port {port} did not start in time")
+            except OSError as e:
+                self.logger.warning(f"Could not start a server on port {port}: {e}")
+                self.unavailable_ports.add(port)
+            except Exception as e:
+                raise PoolError(f"Server on port {port} failed to start: {e}")
+        raise PoolError("No free port to start a server on")
+
+    async def acquire(self):
+        """Return a listening server, from the pool if one is idle."""
+        try:
+            while self.idle:
+                server = self.idle.popleft()
+                if server.running:
+                    return server
+            return await self.start_server()
+        finally:
+            self.fill()
+
+    def release(self, server):
+        """
+        Take back a server that is no longer used as a room. Only empty
+        servers are recycled; servers that still have clients are stopped.
+        """
+        if (
+            server.running
+            and not server.get_client_count()
+            and len(self.idle) + self.warming < self.warm_size
+        ):
+            server.request_recycle()
+            self.idle.append(server)
+        else:
+            self.game_host.stop(server)
+
+    def fill(self):
+        """Start servers in the background until warm_size are idle."""
+        missing = self.warm_size - len(self.idle) - self.warming
+        for _ in range(max(missing, 0)):
+            self.warming += 1
+            task = asyncio.get_running_loop().create_task(self._warm())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _warm(self):
+        try:
+            server = await self.start_server()
+        except PoolError as e:
+            self.logger.error(f"Could not pre-start a server: {e}")
+            return
+        finally:
+            self.warming -= 1
+        self.idle.append(server)
+
+    async def close(self, timeout=5.0):
+        """
+        Stop every server the pool started, idle or handed out, and wait up
+        to timeout seconds until they have shut down, so the host's loops
+        can be stopped without cutting them off.
+        """
+        self.warm_size = 0
+        for task in list(self.tasks):
+            task.cancel()
+        self.idle.clear()
+        servers = list(self.servers)
+        for server in servers:
+            self.game_host.stop(server)
+        finished = [asyncio.wrap_future(server.finished) for server in servers]
+        if finished:
+            _, pending = await asyncio.wait(finished, timeout=timeout)
+            if pending:
+                self.logger.warning(f"{len(pending)} servers did not shut down")
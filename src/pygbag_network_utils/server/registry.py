@@ -0,0 +1,66 @@
+class Registry:
+    """
+    Insertion-ordered mapping owned by a single event loop.
+
+    All mutations happen on the loop that owns the registry, so no lock is
+    needed. Adding and removing entries is O(1). Iteration goes over an
+    immutable snapshot that is rebuilt lazily after a change, so a broadcast
+    can loop over the clients while handlers add and remove others, and
+    repeated broadcasts between changes reuse the same tuple.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._keys = None
+        self._values = None
+        self._items = None
+
+    def _changed(self):
+        self._keys = self._values = self._items = None
+
+    def add(self, key, value=None):
+        self._entries[key] = value
+        self._changed()
+
+    def pop(self, key, default=None):
+        if key not in self._entries:
+            return default
+        self._changed()
+        return self._entries.pop(key)
+
+    def discard(self, key):
+        self.pop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._changed()
+
+    def get(self, key, default=None):
+        return self._entries.get(key, default)
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = tuple(self._entries)
+        return self._keys
+
+    def values(self):
+        if self._values is None:
+            self._values = tuple(self._entries.values())
+        return self._values
+
+    def items(self):
+        if self._items is None:
+            self._items = tuple(self._entries.items())
+        return self._items
@@ -0,0 +1,84 @@
+import collections
+import copy
+import logging
+
+from ..delta import diff
+
+
+class StateReplicator:
+    """
+    Replicates room state to the clients of a BaseServer.
+
+    Every replicate() call numbers a snapshot and sends each client only the
+    fields that changed since the last snapshot that client acknowledged,
+    with a full keyframe every keyframe_interval snapshots and whenever a
+    client has no usable baseline. Clients acknowledge with {"ack": <seq>};
+    pass those messages to handle_ack. Clients sharing a baseline and codec
+    share one encoded frame.
+    """
+
+    def __init__(self, server, keyframe_interval=30, history_size=64):
+        self.server = server
+        self.keyframe_interval = keyframe_interval
+        self.history_size = history_size
+        self.seq = 0
+        self.history = collections.OrderedDict()
+        self.acked = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def handle_ack(self, websocket, data):
+        """
+        Record an acknowledgement if data is one. Returns True when data was
+        an ack so callers can skip their own handling.
+        """
+        if not isinstance(data, dict) or "ack" not in data:
+            return False
+        seq = data["ack"]
+        if not isinstance(seq, int) or isinstance(seq, bool):
+            # Malformed acks are dropped rather than trusted as a baseline.
+            return True
+        if seq in self.history and seq > self.acked.get(websocket, 0):
+            self.acked[websocket] = seq
+        return True
+
+    async def replicate(self, state):
+        """Send state to all clients of the server and remember it as a baseline."""
+        self.seq += 1
+        snapshot = copy.deepcopy(state)
+        keyframe = self.seq % self.keyframe_interval == 1 or self.keyframe_interval == 1
+        if keyframe:
+            self.acked = {
+                websocket: seq
+                for websocket, seq in self.acked.items()
+                if websocket in self.server.channels
+            }
+
+        messages = {}
+        frames = {}
+        for websocket, channel in self.server.channels.items():
+            baseline = None if keyframe else self.acked.get(websocket)
+            if baseline not in self.history:
+                baseline = None
+            key = (baseline, channel.codec.name)
+            frame = frames.get(key)
+            if frame is None:
+                message = messages.get(baseline)
+                if message is None:
+                    message = messages[baseline] = self.build_message(
+                        snapshot, baseline
+                    )
+                frame = frames[key] = channel.codec.frame(message)
+            channel.put(frame)
+
+        self.history[self.seq] = snapshot
+        while len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+
+    def build_message(self, snapshot, baseline):
+        if baseline is None:
+            return {"snapshot": self.seq, "state": snapshot}
+        return {
+            "snapshot": self.seq,
+            "baseline": baseline,
+            "delta": diff(self.history[baseline], snapshot),
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import bisect
+import collections
+import inspect
+import logging
+
+
+class TickStats:
+    """Histogram of tick durations plus overrun, skip and shed counters."""
+
+    # Upper bounds of the histogram buckets in milliseconds; the last bucket
+    # collects everything slower.
+    BUCKETS_MS = (1, 2, 5, 10, 16, 25, 50, 100, 250, 500)
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.buckets = [0] * (len(self.BUCKETS_MS) + 1)
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.shed = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+
+    def record(self, duration):
+        self.ticks += 1
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.buckets[bisect.bisect_left(self.BUCKETS_MS, duration * 1000)] += 1
+        if duration > self.budget:
+            self.overruns += 1
+
+    def snapshot(self):
+        labels = [f"<={bound}ms" for bound in self.BUCKETS_MS]
+        labels.append(f">{self.BUCKETS_MS[-1]}ms")
+        return {
+            "budget": self.budget,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "shed": self.shed,
+            "mean_duration": self.total_duration / self.ticks if self.ticks else 0.0,
+            "max_duration": self.max_duration,
+            "histogram": dict(zip(labels, self.buckets)),
+        }
+
+
+class TickScheduler:
+    """
+    Calls an async tick(dt) callback at a fixed rate.
+
+    Ticks are scheduled against absolute deadlines, so time spent inside a
+    tick does not make the rate drift. When the loop falls behind it runs
+    up to max_catch_up ticks back to back and skips the rest. Work passed
+    to defer() runs after a tick only while the tick budget lasts; with
+    shed_on_overrun it is dropped whenever a tick runs over budget.
+    """
+
+    def __init__(self, rate, tick, max_catch_up=5, shed_on_overrun=False):
+        self.interval = 1.0 / rate
+        self.tick = tick
+        self.max_catch_up = max_catch_up
+        self.shed_on_overrun = shed_on_overrun
+        self.stats = TickStats(self.interval)
+        self.deferred = collections.deque()
+        self.over_budget = False
+        # True from the start of a tick until its deferred work is done.
+        self.ticking = False
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def defer(self, callback):
+        """Queue non-critical work (a callable, sync or async) for after a tick."""
+        self.deferred.append(callback)
+
+    async def run(self, is_running):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while is_running():
+            now = loop.time()
+            if now < next_tick:
+                await asyncio.sleep(next_tick - now)
+                continue
+
+            behind = int((now - next_tick) / self.interval)
+            if behind > self.max_catch_up:
+                skipped = behind - self.max_catch_up
+                self.stats.skipped += skipped
+                next_tick += skipped * self.interval
+
+            started = loop.time()
+            self.ticking = True
+            await self.tick(self.interval)
+            duration = loop.time() - started
+            self.stats.record(duration)
+            self.over_budget = duration > self.interval
+            next_tick += self.interval
+
+            await self._run_deferred(loop, started)
+            self.ticking = False
+            if next_tick <= loop.time():
+                # Catching up; still give clients a turn between ticks.
+                await asyncio.sleep(0)
+
+    async def _run_deferred(self, loop, started):
+        if self.over_budget and self.shed_on_overrun:
+            self.stats.shed += len(self.deferred)
+            self.deferred.clear()
+            return
+        while self.deferred and loop.time() - started < self.interval:
+            callback = self.deferred.popleft()
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.logger.exception(f"Error in deferred work: {e}")
@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+
+import websockets
+
+from ..codec import JSON, DecodeError
+from . import EchoServer
+from .cluster import TOKEN_ENV
+from .hosting import HOSTS, create_host
+from .pool import PoolError, RoomPool
+
+
+def load_class(path):
+    """Import a "module:Class" path."""
+    module_name, _, name = path.partition(":")
+    target = importlib.import_module(module_name)
+    for part in name.split("."):
+        target = getattr(target, part)
+    return target
+
+
+class GameWorker:
+    """
+    A game server process that hosts rooms for a MainServer lobby.
+
+    The worker connects to the lobby's /worker path, registers with the
+    lobby's token and then creates and stops rooms on request. Rooms come from
+    a RoomPool, so the lobby only hears about a room once it is listening. The
+    worker reports its room and client counts every report_interval seconds,
+    which the lobby uses to place new rooms on the least loaded worker. A
+    draining lobby has it drain its rooms first. It stops all its rooms and
+    exits when the lobby connection ends.
+    """
+
+    def __init__(
+        self,
+        lobby_url,
+        token,
+        game_server_class=EchoServer,
+        host="localhost",
+        advertise_host=None,
+        port_base=10000,
+        max_rooms=None,
+        warm_rooms=0,
+        hosting="shared",
+        workers=None,
+        report_interval=1.0,
+        ssl_context=None,
+    ):
+        self.lobby_url = lobby_url
+        self.token = token
+        self.game_server_class = game_server_class
+        self.host = host
+        self.advertise_host = advertise_host or host
+        self.max_rooms = max_rooms
+        self.report_interval = report_interval
+        self.ssl_context = ssl_context
+        self.game_host = create_host(hosting, workers)
+        self.pool = RoomPool(
+            self.game_host,
+            lambda port: self.game_server_class(self.host, port, self.ssl_context),
+            port_base=port_base,
+            warm_size=warm_rooms,
+        )
+        # Maps the lobby's server id to the game server hosting that room.
+        self.rooms = {}
+        self.tasks = set()
+        self.websocket = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def send(self, data):
+        try:
+            await self.websocket.send(JSON.frame(data))
+        except websockets.exceptions.ConnectionClosed:
+            # run() sees the closed connection and shuts the worker down.
+            self.logger.debug("Lobby connection closed while sending")
+
+    async def create_room(self, server_id):
+        if self.max_rooms is not None and len(self.rooms) >= self.max_rooms:
+            await self.send(
+                {
+                    "command": "create_failed",
+                    "server_id": server_id,
+                    "error": "Worker is full",
+                }
+            )
+            return
+        try:
+            server = await self.pool.acquire()
+        except PoolError as e:
+            await self.send(
+                {"command": "create_failed", "server_id": server_id, "error": str(e)}
+            )
+            return
+        self.rooms[server_id] = server
+        self.logger.info(f"Created room {server_id} on port {server.port}")
+        await self.send(
+            {"command": "created", "server_id": server_id, "port": server.port}
+        )
+        await self.send(self.load_report())
+
+    def stop_room(self, server_id):
+        server = self.rooms.pop(server_id, None)
+        if server is not None:
+            self.pool.release(server)
+            self.logger.info(f"Stopped room {server_id}")
+
+    async def drain_rooms(self, server_ids):
+        """
+        Drain rooms server_ids, so their clients get everything queued for
+        them before the connections close, then tell the lobby.
+        """
+        drains = []
+        for server_id in server_ids:
+            server = self.rooms.pop(server_id, None)
+            if server is None:
+                continue
+            future = server.request_drain(0)
+            if future is not None:
+                drains.append(asyncio.wrap_future(future))
+            self.pool.release(server)
+        await asyncio.gather(*drains, return_exceptions=True)
+        self.logger.info(f"Drained {len(drains)} rooms")
+        await self.send({"command": "drained"})
+        await self.send(self.load_report())
+
+    def load_report(self):
+        rooms = {
+            str(server_id): server.get_client_count()
+            for server_id, server in self.rooms.items()
+        }
+        return {"command": "load", "rooms": rooms, "clients": sum(rooms.values())}
+
+    async def report_load(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            await self.send(self.load_report())
+
+    async def handle_command(self, data):
+        command = data.get("command")
+        if command == "create":
+            # Waiting for the room to listen must not hold up other commands.
+            task = asyncio.create_task(self.create_room(data["server_id"]))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        elif command == "drain":
+            task = asyncio.create_task(self.drain_rooms(data["server_ids"]))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        elif command == "stop":
+            self.stop_room(data["server_id"])
+            await self.send(self.load_report())
+        else:
+            self.logger.warning(f"Unknown lobby command: {command}")
+
+    async def run(self):
+        async with websockets.connect(self.lobby_url) as websocket:
+            self.websocket = websocket
+            await self.send(
+                {
+                    "command": "register",
+                    "token": self.token,
+                    "host": self.advertise_host,
+                    "max_rooms": self.max_rooms,
+                }
+            )
+            reply = JSON.decode(await websocket.recv())
+            if "registered" not in reply:
+                self.logger.error(f"Lobby refused registration: {reply.get('error')}")
+                return
+            self.logger.info(f"Registered with lobby as worker {reply['registered']}")
+            self.pool.fill()
+            reporter = asyncio.create_task(self.report_load())
+            try:
+                async for message in websocket:
+                    try:
+                        await self.handle_command(JSON.decode(message))
+                    except (DecodeError, KeyError) as e:
+                        self.logger.error(f"Invalid lobby command: {e}")
+            except websockets.exceptions.ConnectionClosed:
+                # A draining lobby closes with 1001, which is not an error.
+                self.logger.info("Lost connection to the lobby")
+            finally:
+                reporter.cancel()
+                for task in list(self.tasks):
+                    task.cancel()
+                for server_id in list(self.rooms):
+                    self.stop_room(server_id)
+                await self.pool.close()
+                self.game_host.shutdown()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(description="Game server worker for a lobby")
+    parser.add_argument(
+        "--lobby",
+        type=str,
+        default="ws://localhost:8765/worker",
+        help="URL of the lobby's worker endpoint",
+    )
+    parser.add_argument(
+        "--host", type=str, default="localhost", help="Host the rooms listen on"
+    )
+    parser.add_argument(
+        "--advertise-host",
+        type=str,
+        default=None,
+        help="Host clients should connect to (defaults to --host)",
+    )
+    parser.add_argument(
+        "--port-base", type=int, default=10000, help="First port used for rooms"
+    )
+    parser.add_argument(
+        "--max-rooms", type=int, default=None, help="Most rooms this worker hosts"
+    )
+    parser.add_argument(
+        "--warm-rooms",
+        type=int,
+        default=0,
+        help="Number of idle rooms kept started, ready to hand out",
+    )
+    parser.add_argument(
+        "--game-server",
+        type=str,
+        default="pygbag_network_utils.server:EchoServer",
+        help="Game server class as module:Class",
+    )
+    parser.add_argument(
+        "--hosting",
+        choices=sorted(HOSTS),
+        default="shared",
+        help="How the worker runs its rooms",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of loops for pool hosting (defaults to the CPU count)",
+    )
+    parser.add_argument(
+        "--token",
+        type=str,
+        default=os.environ.get(TOKEN_ENV),
+        help=f"Lobby registration token (defaults to ${TOKEN_ENV})",
+    )
+
+    args = parser.parse_args()
+
+    worker = GameWorker(
+        args.lobby,
+        args.token,
+        game_server_class=load_class(args.game_server),
+        host=args.host,
+        advertise_host=args.advertise_host,
+        port_base=args.port_base,
+        max_rooms=args.max_rooms,
+        warm_rooms=args.warm_rooms,
+        hosting=args.hosting,
+        workers=args.workers,
+    )
+    asyncio.run(worker.run())
+
+
+if __name__ == "__main__":
+    main()
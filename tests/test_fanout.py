@@ -0,0 +1,36 @@
+import asyncio
+
+from pygbag_network_utils.server.fanout import ClientChannel
+
+
+class FakeWebSocket:
+    remote_address = ("127.0.0.1", 0)
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(frame)
+
+
+def test_resume_does_not_repeat_frames_queued_before_hello():
+    async def run():
+        old_websocket = FakeWebSocket()
+        old = ClientChannel(old_websocket)
+        old.start_session("token", "REPLY1", 16)
+        old.put("A")
+        await old.drain()
+        old.suspend()
+
+        # A broadcast between the new connection's add_client and its hello
+        # reaches both the suspended channel and the new one.
+        websocket = FakeWebSocket()
+        channel = ClientChannel(websocket)
+        old.put("B")
+        channel.put("B")
+        channel.start_session("token", "REPLY2", 16, old, received=1)
+        await channel.drain()
+        channel.close()
+        return websocket.sent
+
+    assert asyncio.run(run()) == ["REPLY2", "B"]